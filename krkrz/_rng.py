@@ -2,6 +2,14 @@
 #
 # SPDX-License-Identifier: 0BSD
 
+from abc import ABC, abstractmethod
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 _U64_BITS = 2**64 - 1
 
 
@@ -9,6 +17,67 @@ def _rotl64(v: int, k: int) -> int:
     return (v << k) & _U64_BITS | (v >> (64 - k))
 
 
+# Bulk outputs are NumPy arrays when it's available, and arrays from the array
+# module otherwise.
+def _u64_array(values: list[int]):
+    if np is not None:
+        return np.array(values, dtype=np.uint64)
+    return array("Q", values)
+
+
+def _u32_array(values: list[int]):
+    if np is not None:
+        return np.array(values, dtype=np.uint64).astype(np.uint32)
+    return array("I", [v & 0xFFFFFFFF for v in values])
+
+
+def _berlekamp_massey(bits: list[int]) -> int:
+    # Minimal polynomial of a GF(2) sequence, as x^L + c1 x^(L-1) + ... + cL
+    # with the coefficient of x^i in bit i
+    c, b = 1, 1
+    length, m = 0, 1
+    for n, bit in enumerate(bits):
+        d = bit
+        for i in range(1, length + 1):
+            d ^= (c >> i) & bits[n - i]
+        d &= 1
+        if d == 0:
+            m += 1
+        elif 2 * length <= n:
+            c, b = c ^ (b << m), c
+            length = n + 1 - length
+            m = 1
+        else:
+            c ^= b << m
+            m += 1
+    return sum(1 << (length - i) for i in range(length + 1) if (c >> i) & 1)
+
+
+def _mulmod(a: int, b: int, modulus: int) -> int:
+    # Product of two GF(2) polynomials, reduced by modulus
+    degree = modulus.bit_length() - 1
+    result = 0
+    while b:
+        if b & 1:
+            result ^= a
+        b >>= 1
+        a <<= 1
+        if (a >> degree) & 1:
+            a ^= modulus
+    return result
+
+
+def _powmod_x(n: int, modulus: int) -> int:
+    # x^n reduced by modulus
+    result, base = 1, 2
+    while n:
+        if n & 1:
+            result = _mulmod(result, base, modulus)
+        base = _mulmod(base, base, modulus)
+        n >>= 1
+    return result
+
+
 class SplitMix64:
     def __init__(self, state: int = 0) -> None:
         self.state = state
@@ -21,8 +90,81 @@ class SplitMix64:
         z = (z ^ (z >> 27)) * 0x94D049BB133111EB & _U64_BITS
         return z ^ (z >> 31)
 
+    def fill(self, n: int):
+        if np is None:
+            return _u64_array([self.next() for _ in range(n)])
+
+        # Every output only depends on its own state, so they're all computed
+        # at once.
+        steps = np.arange(1, n + 1, dtype=np.uint64)
+        z = steps * np.uint64(0x9E3779B97F4A7C15) + np.uint64(self.state)
+        self.state = (self.state + 0x9E3779B97F4A7C15 * n) & _U64_BITS
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+    def next_u32_array(self, n: int):
+        values = self.fill(n)
+        if np is None:
+            return array("I", [v & 0xFFFFFFFF for v in values])
+        return values.astype(np.uint32)
+
+    def advance(self, n: int) -> None:
+        self.state = (self.state + 0x9E3779B97F4A7C15 * n) & _U64_BITS
+
+
+class _Xoroshiro128(ABC):
+    # Jump polynomials for 2^64 and 2^96 steps, from the reference
+    # implementation, with the coefficient of x^i in bit i
+    JUMP: int
+    LONG_JUMP: int
+    _polynomial: int
+
+    state: tuple[int, int]
+
+    @abstractmethod
+    def next(self) -> int: ...
+
+    @classmethod
+    def _characteristic_polynomial(cls) -> int:
+        # The state transition is linear over GF(2), so any of the state bits
+        # follows its characteristic polynomial.
+        if "_polynomial" not in cls.__dict__:
+            rng = cls((0x0123456789ABCDEF, 0xFEDCBA9876543210))  # type: ignore
+            bits = []
+            for _ in range(256):
+                bits.append(rng.state[0] & 1)
+                rng.next()
+            cls._polynomial = _berlekamp_massey(bits)
+        return cls._polynomial
+
+    def _jump(self, polynomial: int) -> None:
+        # With x^n = sum(p_i x^i), the state n steps ahead is the sum of the
+        # states i steps ahead where p_i is set.
+        s0, s1 = 0, 0
+        for i in range(128):
+            if (polynomial >> i) & 1:
+                s0 ^= self.state[0]
+                s1 ^= self.state[1]
+            self.next()
+        self.state = (s0, s1)
+
+    def jump(self) -> None:
+        self._jump(self.JUMP)
+
+    def long_jump(self) -> None:
+        self._jump(self.LONG_JUMP)
+
+    def advance(self, n: int) -> None:
+        # The period is 2^128 - 1, so negative n steps back
+        n %= 2**128 - 1
+        self._jump(_powmod_x(n, self._characteristic_polynomial()))
+
+
+class Xoroshiro128PlusPlus(_Xoroshiro128):
+    JUMP = 0x0992CCAF6A6FCA05_2BD7A6A6E99C2DDC
+    LONG_JUMP = 0x9C6E6877736C46E3_360FD5F2CF8D5D99
 
-class Xoroshiro128PlusPlus:
     def __init__(self, state: tuple[int, int]) -> None:
         self.state = state
 
@@ -38,8 +180,31 @@ class Xoroshiro128PlusPlus:
         )
         return result
 
+    def _next_many(self, n: int) -> list[int]:
+        # Same as calling next() n times, with the state kept in locals
+        s0, s1 = self.state
+        out = [0] * n
+        for i in range(n):
+            result = (s0 + s1) & _U64_BITS
+            result = ((result << 17) & _U64_BITS | result >> 47) + s0
+            out[i] = result & _U64_BITS
+            s1 ^= s0
+            s0 = ((s0 << 49) & _U64_BITS | s0 >> 15) ^ s1 ^ ((s1 << 21) & _U64_BITS)
+            s1 = (s1 << 28) & _U64_BITS | s1 >> 36
+        self.state = (s0, s1)
+        return out
+
+    def fill(self, n: int):
+        return _u64_array(self._next_many(n))
+
+    def next_u32_array(self, n: int):
+        return _u32_array(self._next_many(n))
+
+
+class Xoroshiro128StarStar(_Xoroshiro128):
+    JUMP = 0x170865DF4B3201FC_DF900294D8F554A5
+    LONG_JUMP = 0xDDDF9B1090AA7AC1_D2A98B26625EEE7B
 
-class Xoroshiro128StarStar:
     def __init__(self, state: tuple[int, int]) -> None:
         self.state = state
 
@@ -53,3 +218,23 @@ class Xoroshiro128StarStar:
             _rotl64(sx, 37),
         )
         return result
+
+    def _next_many(self, n: int) -> list[int]:
+        # Same as calling next() n times, with the state kept in locals
+        s0, s1 = self.state
+        out = [0] * n
+        for i in range(n):
+            result = (s0 * 5) & _U64_BITS
+            result = ((result << 7) & _U64_BITS | result >> 57) * 9
+            out[i] = result & _U64_BITS
+            s1 ^= s0
+            s0 = ((s0 << 24) & _U64_BITS | s0 >> 40) ^ s1 ^ ((s1 << 16) & _U64_BITS)
+            s1 = (s1 << 37) & _U64_BITS | s1 >> 27
+        self.state = (s0, s1)
+        return out
+
+    def fill(self, n: int):
+        return _u64_array(self._next_many(n))
+
+    def next_u32_array(self, n: int):
+        return _u32_array(self._next_many(n))
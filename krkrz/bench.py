@@ -0,0 +1,282 @@
+# SPDX-FileCopyrightText: 2024 yanchan09 <yan@omg.lol>
+#
+# SPDX-License-Identifier: 0BSD
+
+import argparse
+import json
+import os
+import platform
+import struct
+import sys
+import tempfile
+import timeit
+from typing import Callable
+
+from krkrz._rng import SplitMix64, Xoroshiro128PlusPlus, Xoroshiro128StarStar
+from krkrz.cx3.bytecode import Blackbox, BytecodeEmitter, RNGVariant
+from krkrz.cx3.crypt import KeyDerivator, fnv_blake
+from krkrz.cx3.hashdb import HashDatabase, HashType
+from krkrz.cx3.hashindex import SortedHashIndex, export_index
+from krkrz.cx3.table import MarshalReader
+
+# Every benchmark is a setup function returning the callable that gets timed.
+# Inputs are generated from fixed seeds so results are comparable between
+# revisions.
+Benchmark = Callable[[], Callable[[], object]]
+
+BENCHMARKS: dict[str, Benchmark] = {}
+
+ORDER = [3, 1, 4, 0, 7, 5, 2, 6, 2, 0, 5, 1, 4, 3, 1, 2, 0]
+
+
+def benchmark(name: str) -> Callable[[Benchmark], Benchmark]:
+    def register(setup: Benchmark) -> Benchmark:
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+def _seed_block() -> list[int]:
+    rng = SplitMix64(0x5EED)
+    return [rng.next() & 0xFFFFFFFF for _ in range(1024)]
+
+
+def marshal_value(value: bytes | list | int) -> bytes:
+    # Inverse of MarshalReader.read_value
+    if isinstance(value, list):
+        parts = [struct.pack(">BI", 0x81, len(value))]
+        parts.extend(marshal_value(v) for v in value)
+        return b"".join(parts)
+    elif isinstance(value, bytes):
+        return struct.pack(">BI", 0x03, len(value)) + value
+    else:
+        return struct.pack(">BQ", 0x04, value)
+
+
+def generate_table(paths: int, files_per_path: int) -> bytes:
+    # Marshalled archive table with random hashes and keys
+    rng = SplitMix64(0x7AB1E)
+    table: list = []
+    file_id = 0
+    for _ in range(paths):
+        children: list = []
+        for _ in range(files_per_path):
+            name_hash = b"".join(struct.pack("<Q", rng.next()) for _ in range(4))
+            children.extend([name_hash, [file_id, rng.next()]])
+            file_id += 1
+        table.extend([struct.pack("<Q", rng.next()), children])
+    return marshal_value(table)
+
+
+@benchmark("rng.splitmix64.next")
+def bench_splitmix64() -> Callable[[], object]:
+    rng = SplitMix64(0x1234)
+    return rng.next
+
+
+@benchmark("rng.xoroshiro128plusplus.next")
+def bench_xoroshiro128plusplus() -> Callable[[], object]:
+    rng = Xoroshiro128PlusPlus((0x0123456789ABCDEF, 0xFEDCBA9876543210))
+    return rng.next
+
+
+@benchmark("rng.xoroshiro128starstar.next")
+def bench_xoroshiro128starstar() -> Callable[[], object]:
+    rng = Xoroshiro128StarStar((0x0123456789ABCDEF, 0xFEDCBA9876543210))
+    return rng.next
+
+
+@benchmark("rng.xoroshiro128plusplus.fill")
+def bench_xoroshiro128plusplus_fill() -> Callable[[], object]:
+    rng = Xoroshiro128PlusPlus((0x0123456789ABCDEF, 0xFEDCBA9876543210))
+    return lambda: rng.fill(1024)
+
+
+@benchmark("bytecode.emit")
+def bench_emit() -> Callable[[], object]:
+    slot = 0
+
+    def run() -> object:
+        nonlocal slot
+        slot = (slot + 1) % 128
+        return BytecodeEmitter(slot, ORDER, RNGVariant.PLUS).emit()
+
+    return run
+
+
+@benchmark("bytecode.blackbox.execute")
+def bench_blackbox_execute() -> Callable[[], object]:
+    blackbox = Blackbox(ORDER, RNGVariant.PLUS, seed_block=_seed_block())
+    blackbox.warm()
+    rng = SplitMix64(0x1234)
+    values = [rng.next() for _ in range(4096)]
+    i = 0
+
+    def run() -> object:
+        nonlocal i
+        i = (i + 1) % len(values)
+        return blackbox.execute(values[i])
+
+    return run
+
+
+@benchmark("crypt.fnv_blake")
+def bench_fnv_blake() -> Callable[[], object]:
+    data = bytes(range(256)) * 4
+    return lambda: fnv_blake(data, 0)
+
+
+@benchmark("crypt.keyderivator.derive")
+def bench_derive() -> Callable[[], object]:
+    derivator = KeyDerivator(
+        bootstrap_string="BOOTSTRAPbootstrap0123456789",
+        warning_string="WARNINGwarning0123456789",
+        params_blob=bytes(range(256)),
+        archive_unique_key="ArchiveUniqueKey0123456789",
+        upper_key_seed=b"\x00\x11\x22\x33\x44\x55\x66\x77",
+    )
+    return derivator.derive
+
+
+@benchmark("table.marshal.read_value")
+def bench_read_value() -> Callable[[], object]:
+    data = generate_table(2000, 10)
+    return lambda: MarshalReader(data).read_value()
+
+
+def _hash_database(path: str, cache_size: int = 65536) -> tuple[HashDatabase, list]:
+    # 20000 known file hashes, and lookups of which half miss
+    hdb = HashDatabase(path, cache_size)
+    rng = SplitMix64(0x4A54)
+    hashes = [
+        b"".join(struct.pack("<Q", rng.next()) for _ in range(4)) for _ in range(20000)
+    ]
+    hdb.insert_many(
+        (HashType.FILE_BLAKE2S, name_hash, None, f"file{i}.txt")
+        for i, name_hash in enumerate(hashes)
+    )
+    return hdb, hashes[::2] + [h[::-1] for h in hashes[::2]]
+
+
+def _resolve_hash(cache_size: int) -> Callable[[], object]:
+    tmp_dir = tempfile.TemporaryDirectory()
+    hdb, lookups = _hash_database(os.path.join(tmp_dir.name, "hashes.db"), cache_size)
+    i = 0
+
+    def run() -> object:
+        nonlocal i
+        i = (i + 1) % len(lookups)
+        return hdb.resolve_hash(HashType.FILE_BLAKE2S, lookups[i])
+
+    run.tmp_dir = tmp_dir  # type: ignore # keeps the database around
+    return run
+
+
+@benchmark("hashdb.resolve_hash")
+def bench_resolve_hash() -> Callable[[], object]:
+    # Without the cache, which would answer every repeated lookup
+    return _resolve_hash(0)
+
+
+@benchmark("hashdb.resolve_hash.cached")
+def bench_resolve_hash_cached() -> Callable[[], object]:
+    # Every lookup after the first round is a cache hit
+    return _resolve_hash(65536)
+
+
+@benchmark("hashdb.resolve_many")
+def bench_resolve_many() -> Callable[[], object]:
+    tmp_dir = tempfile.TemporaryDirectory()
+    hdb, lookups = _hash_database(os.path.join(tmp_dir.name, "hashes.db"), 0)
+
+    def run() -> object:
+        return hdb.resolve_many(HashType.FILE_BLAKE2S, lookups)
+
+    run.tmp_dir = tmp_dir  # type: ignore # keeps the database around
+    return run
+
+
+@benchmark("hashindex.resolve_many")
+def bench_index_resolve_many() -> Callable[[], object]:
+    tmp_dir = tempfile.TemporaryDirectory()
+    hdb, lookups = _hash_database(os.path.join(tmp_dir.name, "hashes.db"))
+    export_index(hdb, os.path.join(tmp_dir.name, "hashes.idx"))
+    index = SortedHashIndex(os.path.join(tmp_dir.name, "hashes.idx"))
+
+    def run() -> object:
+        return index.resolve_many(HashType.FILE_BLAKE2S, lookups)
+
+    run.tmp_dir = tmp_dir  # type: ignore # keeps the index around
+    return run
+
+
+def run_benchmarks(
+    names: None | list[str] = None, repeat: int = 5, min_time: float = 0.2
+) -> dict:
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if names and not any(name.startswith(prefix) for prefix in names):
+            continue
+        timer = timeit.Timer(setup())
+        # Grow the number of calls per round until one round takes min_time
+        number = 1
+        while True:
+            elapsed = timer.timeit(number)
+            if elapsed >= min_time:
+                break
+            number = max(number * 2, int(number * min_time / max(elapsed, 1e-9)))
+        times = sorted(t / number for t in timer.repeat(repeat, number))
+        results[name] = {
+            "number": number,
+            "best": times[0],
+            "median": times[len(times) // 2],
+        }
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list[str]:
+    # Names of benchmarks whose best time got worse by more than threshold
+    regressions = []
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        ratio = result["best"] / baseline["results"][name]["best"]
+        print(f"{name}: {ratio:.2f}x", file=sys.stderr)
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="bench")
+    parser.add_argument("names", nargs="*")
+    parser.add_argument("-o", "--output")
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument("-t", "--min-time", type=float, default=0.2)
+    parser.add_argument("-c", "--compare")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.names, args.repeat, args.min_time)
+    for name, result in report["results"].items():
+        print(f"{name}: {result['best'] * 1e6:.3f} us", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.threshold)
+        if regressions:
+            print(f"Regressed: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
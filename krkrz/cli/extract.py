@@ -0,0 +1,34 @@
+# SPDX-FileCopyrightText: 2024 yanchan09 <yan@omg.lol>
+#
+# SPDX-License-Identifier: 0BSD
+
+import argparse
+import sys
+from krkrz.xp3 import ExtractStats, XP3Archive
+
+
+def print_progress(stats: ExtractStats) -> None:
+    print(
+        f"\r{stats.files}/{stats.total_files} files,"
+        f" {stats.bytes_written >> 20}/{stats.total_bytes >> 20} MiB,"
+        f" {stats.rate() / (1 << 20):.1f} MiB/s",
+        end="",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="extract")
+    parser.add_argument("filenames", nargs="+")
+    parser.add_argument("-o", "--output", default=".")
+    parser.add_argument("-j", "--workers", type=int)
+    args = parser.parse_args()
+
+    for filename in args.filenames:
+        with XP3Archive.open(filename) as archive:
+            stats = archive.extract_all(args.output, args.workers, print_progress)
+        print(file=sys.stderr)
+        print(
+            f"{filename}: {stats.files} files, {stats.bytes_written} bytes,"
+            f" {stats.rate() / (1 << 20):.1f} MiB/s"
+        )
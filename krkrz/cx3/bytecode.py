@@ -2,9 +2,18 @@
 #
 # SPDX-License-Identifier: 0BSD
 
+from abc import ABC, abstractmethod
+from array import array
 from enum import Enum, auto
+import json
+import os
 from krkrz._rng import SplitMix64, Xoroshiro128PlusPlus, Xoroshiro128StarStar
-from typing import Protocol
+from typing import Any, Callable, Iterable, Protocol
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 class StopExecution(Exception):
@@ -152,6 +161,356 @@ class BytecodeInterpreter:
 
 BytecodeInstruction = tuple[Instruction, int]
 
+CompiledBytecode = Callable[[int, list[int]], int]
+
+
+_COMPILER_TEMPLATES = {
+    Instruction.ADD_ARG: "v = (v + {arg}) & 0xFFFFFFFF",
+    Instruction.ADD_CONTEXT: "v = (v + {ctx}) & 0xFFFFFFFF",
+    Instruction.ADD_ONE: "v = (v + 1) & 0xFFFFFFFF",
+    Instruction.BITWISE_NOT: "v = ~v & 0xFFFFFFFF",
+    Instruction.BITWISE_XOR: "v ^= {arg}",
+    Instruction.LOAD_ARG: "v = {arg}",
+    Instruction.LOAD_FROM_BUFFER: "v = seed_block[{arg}]",
+    Instruction.LOAD_FROM_BUFFER_INDIRECT: "v = seed_block[v & {arg}]",
+    Instruction.LOAD_INPUT: "v = input",
+    Instruction.MULTIPLY_CONTEXT: "v = (v * {ctx}) & 0xFFFFFFFF",
+    Instruction.NEGATE: "v = -v & 0xFFFFFFFF",
+    Instruction.SAVE_TO_CONTEXT: "{ctx} = v",
+    Instruction.SHL_CONTEXT: "v = (v << ({ctx} & 0xF)) & 0xFFFFFFFF",
+    Instruction.SHR_CONTEXT: "v = v >> ({ctx} & 0xF)",
+    Instruction.SHUFFLE: "v = ((v & {arg}) >> 1 | (v & ~{arg}) << 1) & 0xFFFFFFFF",
+    Instruction.SUBTRACT_FROM_CONTEXT: "v = ({ctx} - v) & 0xFFFFFFFF",
+    Instruction.SUBTRACT_ARG: "v = (v - {arg}) & 0xFFFFFFFF",
+    Instruction.SUBTRACT_CONTEXT: "v = (v - {ctx}) & 0xFFFFFFFF",
+    Instruction.SUBTRACT_ONE: "v = (v - 1) & 0xFFFFFFFF",
+}
+
+
+def compile_bytecode(instructions: list[BytecodeInstruction]) -> CompiledBytecode:
+    # Subroutine depth is known statically at every instruction, so each level
+    # of the interpreter's context stack becomes a plain local variable.
+    lines = ["def bytecode(input, seed_block=()):", "    v = 0", "    c0 = 0"]
+    depth = 0
+    for ty, arg in instructions:
+        if ty == Instruction.SUBROUTINE:
+            depth += 1
+            lines.append(f"    c{depth} = 0")
+        elif ty == Instruction.RETURN:
+            depth -= 1
+            if depth < 0:
+                break
+        else:
+            lines.append(
+                "    " + _COMPILER_TEMPLATES[ty].format(arg=int(arg), ctx=f"c{depth}")
+            )
+    lines.append("    return v")
+
+    # The source is built only from _COMPILER_TEMPLATES and integer
+    # arguments, never from outside input
+    namespace: dict = {}
+    exec("\n".join(lines), namespace)  # noqa: S102
+    return namespace["bytecode"]
+
+
+_U32 = 0xFFFFFFFF
+_U64 = 0xFFFFFFFFFFFFFFFF
+
+
+def execute_vectorized(
+    instructions: list[BytecodeInstruction], inputs: Any, seed_block: Any
+) -> Any:
+    # Runs BytecodeInterpreter.exec over a whole uint64 array of inputs at once.
+    # Lanes are 64 bits wide because the interpreter doesn't truncate its input
+    # and a few instructions (XOR, SHR) carry the upper bits through.
+    value = np.zeros_like(inputs)
+    stack = [np.zeros_like(inputs)]
+    for ty, arg in instructions:
+        ctx = stack[-1]
+        if ty == Instruction.ADD_ARG:
+            value = (value + np.uint64(arg)) & np.uint64(_U32)
+        elif ty == Instruction.ADD_CONTEXT:
+            value = (value + ctx) & np.uint64(_U32)
+        elif ty == Instruction.ADD_ONE:
+            value = (value + np.uint64(1)) & np.uint64(_U32)
+        elif ty == Instruction.BITWISE_NOT:
+            value = ~value & np.uint64(_U32)
+        elif ty == Instruction.BITWISE_XOR:
+            value = value ^ np.uint64(arg)
+        elif ty == Instruction.LOAD_ARG:
+            value = np.full_like(inputs, arg)
+        elif ty == Instruction.LOAD_FROM_BUFFER:
+            value = np.full_like(inputs, seed_block[arg])
+        elif ty == Instruction.LOAD_FROM_BUFFER_INDIRECT:
+            value = seed_block[value & np.uint64(arg)]
+        elif ty == Instruction.LOAD_INPUT:
+            value = inputs.copy()
+        elif ty == Instruction.MULTIPLY_CONTEXT:
+            value = (value * ctx) & np.uint64(_U32)
+        elif ty == Instruction.NEGATE:
+            value = (np.uint64(0) - value) & np.uint64(_U32)
+        elif ty == Instruction.RETURN:
+            stack.pop()
+            if not stack:
+                break
+        elif ty == Instruction.SAVE_TO_CONTEXT:
+            stack[-1] = value
+        elif ty == Instruction.SHL_CONTEXT:
+            value = (value << (ctx & np.uint64(0xF))) & np.uint64(_U32)
+        elif ty == Instruction.SHR_CONTEXT:
+            value = value >> (ctx & np.uint64(0xF))
+        elif ty == Instruction.SHUFFLE:
+            value = (
+                (value & np.uint64(arg)) >> np.uint64(1)
+                | (value & np.uint64(~arg & _U64)) << np.uint64(1)
+            ) & np.uint64(_U32)
+        elif ty == Instruction.SUBTRACT_FROM_CONTEXT:
+            value = (ctx - value) & np.uint64(_U32)
+        elif ty == Instruction.SUBROUTINE:
+            stack.append(np.zeros_like(inputs))
+        elif ty == Instruction.SUBTRACT_ARG:
+            value = (value - np.uint64(arg)) & np.uint64(_U32)
+        elif ty == Instruction.SUBTRACT_CONTEXT:
+            value = (value - ctx) & np.uint64(_U32)
+        elif ty == Instruction.SUBTRACT_ONE:
+            value = (value - np.uint64(1)) & np.uint64(_U32)
+    return value
+
+
+_UNARY_INSTRUCTIONS = {
+    Instruction.ADD_ARG,
+    Instruction.ADD_ONE,
+    Instruction.BITWISE_NOT,
+    Instruction.BITWISE_XOR,
+    Instruction.LOAD_FROM_BUFFER_INDIRECT,
+    Instruction.NEGATE,
+    Instruction.SHUFFLE,
+    Instruction.SUBTRACT_ARG,
+    Instruction.SUBTRACT_ONE,
+}
+
+_BINARY_INSTRUCTIONS = {
+    Instruction.ADD_CONTEXT,
+    Instruction.MULTIPLY_CONTEXT,
+    Instruction.SHL_CONTEXT,
+    Instruction.SHR_CONTEXT,
+    Instruction.SUBTRACT_CONTEXT,
+    Instruction.SUBTRACT_FROM_CONTEXT,
+}
+
+_LEAF_INSTRUCTIONS = {
+    Instruction.LOAD_ARG,
+    Instruction.LOAD_FROM_BUFFER,
+    Instruction.LOAD_INPUT,
+}
+
+# Additive instructions, as the delta they add to the value.
+_ADDITIVE_INSTRUCTIONS = {
+    Instruction.ADD_ARG: lambda arg: arg,
+    Instruction.ADD_ONE: lambda arg: 1,
+    Instruction.SUBTRACT_ARG: lambda arg: -arg & _U32,
+    Instruction.SUBTRACT_ONE: lambda arg: _U32,
+}
+
+
+class _Node(ABC):
+    # "wide" means the value may have bits above the low 32 set. Only the
+    # input (and seed block entries) start out that way; most instructions
+    # mask their result, which is what makes some rewrites exact.
+    wide: bool
+
+    @abstractmethod
+    def emit(self, out: list[BytecodeInstruction]) -> None: ...
+
+
+class _Leaf(_Node):
+    def __init__(self, ty: Instruction, arg: int) -> None:
+        self.ty = ty
+        self.arg = arg
+        self.wide = ty != Instruction.LOAD_ARG
+
+    @property
+    def constant(self) -> None | int:
+        return self.arg if self.ty == Instruction.LOAD_ARG else None
+
+    def emit(self, out: list[BytecodeInstruction]) -> None:
+        out.append((self.ty, self.arg))
+
+
+class _Unary(_Node):
+    def __init__(self, child: _Node, ty: Instruction, arg: int) -> None:
+        self.child = child
+        self.ty = ty
+        self.arg = arg
+        self.wide = (
+            child.wide and ty == Instruction.BITWISE_XOR
+        ) or ty == Instruction.LOAD_FROM_BUFFER_INDIRECT
+
+    def emit(self, out: list[BytecodeInstruction]) -> None:
+        self.child.emit(out)
+        out.append((self.ty, self.arg))
+
+
+class _Binary(_Node):
+    def __init__(self, ty: Instruction, ctx: _Node, value: _Node) -> None:
+        self.ty = ty
+        self.ctx = ctx
+        self.value = value
+        self.wide = value.wide and ty == Instruction.SHR_CONTEXT
+
+    def emit(self, out: list[BytecodeInstruction]) -> None:
+        out.append((Instruction.SUBROUTINE, 0))
+        self.ctx.emit(out)
+        out.append((Instruction.SAVE_TO_CONTEXT, 0))
+        self.value.emit(out)
+        out.append((self.ty, 0))
+        out.append((Instruction.RETURN, 0))
+
+
+def _constant(node: _Node) -> None | int:
+    return node.constant if isinstance(node, _Leaf) else None
+
+
+def _make_additive(child: _Node, delta: int) -> _Node:
+    if delta == 0:
+        # Adding zero only masks the value, so it's a no-op for narrow values
+        return _Unary(child, Instruction.ADD_ARG, 0) if child.wide else child
+    elif delta == 1:
+        return _Unary(child, Instruction.ADD_ONE, 0)
+    elif delta == _U32:
+        return _Unary(child, Instruction.SUBTRACT_ONE, 0)
+    return _Unary(child, Instruction.ADD_ARG, delta)
+
+
+def _make_unary(child: _Node, ty: Instruction, arg: int) -> _Node:
+    constant = _constant(child)
+    if constant is not None and ty != Instruction.LOAD_FROM_BUFFER_INDIRECT:
+        interp = BytecodeInterpreter(0)
+        interp.value = constant
+        interp.exec_one(ty, arg)
+        return _Leaf(Instruction.LOAD_ARG, interp.value)
+
+    if ty == Instruction.LOAD_FROM_BUFFER_INDIRECT and constant is not None:
+        return _Leaf(Instruction.LOAD_FROM_BUFFER, constant & arg)
+    elif ty in _ADDITIVE_INSTRUCTIONS:
+        delta = _ADDITIVE_INSTRUCTIONS[ty](arg)
+        if isinstance(child, _Unary) and child.ty in _ADDITIVE_INSTRUCTIONS:
+            delta += _ADDITIVE_INSTRUCTIONS[child.ty](child.arg)
+            child = child.child
+        return _make_additive(child, delta & _U32)
+    elif ty == Instruction.BITWISE_XOR:
+        if isinstance(child, _Unary) and child.ty == Instruction.BITWISE_XOR:
+            arg ^= child.arg
+            child = child.child
+        return _Unary(child, ty, arg) if arg != 0 else child
+    elif ty in (Instruction.BITWISE_NOT, Instruction.NEGATE):
+        if isinstance(child, _Unary) and child.ty == ty and not child.child.wide:
+            return child.child
+
+    return _Unary(child, ty, arg)
+
+
+def _make_binary(ty: Instruction, ctx: _Node, value: _Node) -> _Node:
+    ctx_constant = _constant(ctx)
+    value_constant = _constant(value)
+    if ctx_constant is not None and value_constant is not None:
+        interp = BytecodeInterpreter(0)
+        interp.value = value_constant
+        interp._ctx = ctx_constant
+        interp.exec_one(ty, 0)
+        return _Leaf(Instruction.LOAD_ARG, interp.value)
+
+    if ctx_constant is not None:
+        if ty == Instruction.ADD_CONTEXT:
+            return _make_unary(value, Instruction.ADD_ARG, ctx_constant)
+        elif ty == Instruction.SUBTRACT_CONTEXT:
+            return _make_unary(value, Instruction.SUBTRACT_ARG, ctx_constant)
+        elif ty == Instruction.SUBTRACT_FROM_CONTEXT:
+            negated = _make_unary(value, Instruction.NEGATE, 0)
+            return _make_unary(negated, Instruction.ADD_ARG, ctx_constant)
+        elif ty == Instruction.SHR_CONTEXT and ctx_constant & 0xF == 0:
+            return value
+        elif ty == Instruction.SHL_CONTEXT and ctx_constant & 0xF == 0:
+            return _make_unary(value, Instruction.ADD_ARG, 0)
+        elif ty == Instruction.MULTIPLY_CONTEXT and ctx_constant == 1:
+            return _make_unary(value, Instruction.ADD_ARG, 0)
+    elif value_constant is not None:
+        if ty == Instruction.ADD_CONTEXT:
+            return _make_unary(ctx, Instruction.ADD_ARG, value_constant)
+        elif ty == Instruction.SUBTRACT_CONTEXT:
+            negated = _make_unary(ctx, Instruction.NEGATE, 0)
+            return _make_unary(negated, Instruction.ADD_ARG, value_constant)
+        elif ty == Instruction.SUBTRACT_FROM_CONTEXT:
+            return _make_unary(ctx, Instruction.SUBTRACT_ARG, value_constant)
+        elif ty == Instruction.MULTIPLY_CONTEXT and value_constant == 1:
+            return _make_unary(ctx, Instruction.ADD_ARG, 0)
+
+    return _Binary(ty, ctx, value)
+
+
+class _NotAnExpression(Exception):
+    pass
+
+
+def _parse_expression(
+    instructions: list[BytecodeInstruction], pos: int
+) -> tuple[_Node, int]:
+    if pos >= len(instructions):
+        raise _NotAnExpression()
+
+    ty, arg = instructions[pos]
+    node: _Node
+    if ty in _LEAF_INSTRUCTIONS:
+        node = _Leaf(ty, arg)
+        pos += 1
+    elif ty == Instruction.SUBROUTINE:
+        ctx, pos = _parse_expression(instructions, pos + 1)
+        if (
+            pos >= len(instructions)
+            or instructions[pos][0] != Instruction.SAVE_TO_CONTEXT
+        ):
+            raise _NotAnExpression()
+        value, pos = _parse_expression(instructions, pos + 1)
+        if pos + 1 >= len(instructions):
+            raise _NotAnExpression()
+        op, _ = instructions[pos]
+        if (
+            op not in _BINARY_INSTRUCTIONS
+            or instructions[pos + 1][0] != Instruction.RETURN
+        ):
+            raise _NotAnExpression()
+        node = _make_binary(op, ctx, value)
+        pos += 2
+    else:
+        raise _NotAnExpression()
+
+    while pos < len(instructions) and instructions[pos][0] in _UNARY_INSTRUCTIONS:
+        ty, arg = instructions[pos]
+        node = _make_unary(node, ty, arg)
+        pos += 1
+    return node, pos
+
+
+def optimize_bytecode(
+    instructions: list[BytecodeInstruction],
+) -> list[BytecodeInstruction]:
+    # Emitted bytecode is an expression tree in postfix form: leaves load a
+    # value, unary instructions follow their operand and every SUBROUTINE
+    # computes a binary op of two subtrees. The tree is rebuilt with constant
+    # subtrees folded and redundant subroutines and arithmetic merged away.
+    # Bytecode that doesn't have that shape is returned unchanged.
+    try:
+        root, pos = _parse_expression(instructions, 0)
+    except _NotAnExpression:
+        return instructions
+    if pos >= len(instructions) or instructions[pos][0] != Instruction.RETURN:
+        return instructions
+
+    out: list[BytecodeInstruction] = []
+    root.emit(out)
+    out.append((Instruction.RETURN, 0))
+    return out
+
 
 class BytecodeTooLargeException(Exception):
     pass
@@ -216,6 +575,10 @@ class RNGProtocol(Protocol):
 
 
 class BytecodeEmitter:
+    # Bump whenever a change here alters the emitted bytecode, so that cached
+    # Blackbox slots get regenerated.
+    VERSION = 1
+
     rng: RNGProtocol
 
     def __init__(self, seed: int, order: list[int], rng_variant: RNGVariant) -> None:
@@ -336,29 +699,186 @@ class BytecodeEmitter:
             raise Exception("emit_inner failed")
 
 
+def slot_seed(idx: int) -> int:
+    seed_lo = idx
+    seed_hi = ~idx & 0xFFFFFFFF
+    return seed_hi << 32 | seed_lo
+
+
+class ExecutionMode(Enum):
+    INTERPRETER = auto()
+    COMPILED = auto()
+
+
 class Blackbox:
-    def __init__(self, order: list[int], rng_variant: RNGVariant) -> None:
+    def __init__(
+        self,
+        order: list[int],
+        rng_variant: RNGVariant,
+        mode: ExecutionMode = ExecutionMode.COMPILED,
+        seed_block: None | list[int] = None,
+        cache_path: None | str = None,
+        optimize: bool = True,
+    ) -> None:
         self.order = order
         self.rng_variant = rng_variant
+        self.mode = mode
+        self.seed_block = [] if seed_block is None else seed_block
+        self.cache_path = cache_path
+        self.optimize = optimize
+        self._cache_checked = cache_path is None
         self.slots: list[None | list[BytecodeInstruction]] = [None] * 128
+        self.optimized_slots: list[None | list[BytecodeInstruction]] = [None] * 128
+        self.compiled_slots: list[None | CompiledBytecode] = [None] * 128
+
+    def _cache_header(self) -> dict:
+        return {
+            "version": BytecodeEmitter.VERSION,
+            "order": list(self.order),
+            "rng_variant": self.rng_variant.name,
+        }
+
+    def _read_cache(self, path: str) -> None | list[list[BytecodeInstruction]]:
+        # Slots stored at path, or None if the file is missing, malformed or
+        # was written for different parameters
+        try:
+            with open(path) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if not isinstance(cached, dict) or cached.get("header") != self._cache_header():
+            return None
+        slots = cached.get("slots")
+        if not isinstance(slots, list) or len(slots) != 128:
+            return None
+        try:
+            return [[(Instruction[ty], int(arg)) for ty, arg in slot] for slot in slots]
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def load(self, path: str) -> bool:
+        slots = self._read_cache(path)
+        if slots is None:
+            return False
+
+        for idx, slot in enumerate(slots):
+            self.slots[idx] = slot
+            self.optimized_slots[idx] = None
+            self.compiled_slots[idx] = None
+        return True
+
+    def save(self, path: str) -> None:
+        cached = {
+            "header": self._cache_header(),
+            "slots": [
+                [(ty.name, arg) for ty, arg in self._ensure_slot(idx)]
+                for idx in range(128)
+            ],
+        }
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(cached, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    def warm(self) -> None:
+        # Emits every slot up front, writing them to cache_path if the cache
+        # was missing or stale.
+        missing = [idx for idx in range(128) if self.slots[idx] is None]
+        if missing and self.cache_path is not None and self.load(self.cache_path):
+            self._cache_checked = True
+            return
+        self._cache_checked = True
+        for idx in missing:
+            self._ensure_slot(idx)
+        # Slots may all have been emitted lazily without the cache being
+        # written, so it's checked even when nothing was missing
+        if self.cache_path is not None and (
+            missing or self._read_cache(self.cache_path) is None
+        ):
+            self.save(self.cache_path)
 
     def _ensure_slot(self, idx: int) -> list[BytecodeInstruction]:
+        if self.slots[idx] is None and not self._cache_checked:
+            self._cache_checked = True
+            self.load(self.cache_path)  # type: ignore # set when not checked
         if self.slots[idx] is None:
-            seed_lo = idx
-            seed_hi = ~idx & 0xFFFFFFFF
-            bc = BytecodeEmitter(seed_hi << 32 | seed_lo, self.order, self.rng_variant)
+            bc = BytecodeEmitter(slot_seed(idx), self.order, self.rng_variant)
             self.slots[idx] = bc.emit()
 
         return self.slots[idx]  # type: ignore # slot is definitely assigned
 
-    def execute(self, value: int) -> int:
-        slot = self._ensure_slot(value % 128)
+    def _ensure_program(self, idx: int) -> list[BytecodeInstruction]:
+        # Bytecode as it gets executed, which may differ from the emitted slot
+        if not self.optimize:
+            return self._ensure_slot(idx)
+
+        optimized = self.optimized_slots[idx]
+        if optimized is None:
+            optimized = optimize_bytecode(self._ensure_slot(idx))
+            self.optimized_slots[idx] = optimized
+        return optimized
+
+    def optimization_report(self) -> list[int]:
+        # Number of instructions the optimizer removed from each slot
+        return [
+            len(self._ensure_slot(idx)) - len(self._ensure_program(idx))
+            for idx in range(128)
+        ]
+
+    def _ensure_compiled_slot(self, idx: int) -> CompiledBytecode:
+        compiled = self.compiled_slots[idx]
+        if compiled is None:
+            compiled = compile_bytecode(self._ensure_program(idx))
+            self.compiled_slots[idx] = compiled
+        return compiled
 
+    def execute(self, value: int) -> int:
         bytecode_input = value >> 7
 
-        interp_lo = BytecodeInterpreter(bytecode_input)
+        if self.mode == ExecutionMode.COMPILED:
+            compiled = self._ensure_compiled_slot(value % 128)
+            result_lo = compiled(bytecode_input, self.seed_block)
+            result_hi = compiled(~bytecode_input & 0xFFFFFFFF, self.seed_block)
+            return result_hi << 32 | result_lo
+
+        slot = self._ensure_program(value % 128)
+
+        interp_lo = BytecodeInterpreter(bytecode_input, self.seed_block)
         result_lo = interp_lo.exec(slot)
 
-        interp_hi = BytecodeInterpreter(~bytecode_input & 0xFFFFFFFF)
+        interp_hi = BytecodeInterpreter(~bytecode_input & 0xFFFFFFFF, self.seed_block)
         result_hi = interp_hi.exec(slot)
         return result_hi << 32 | result_lo
+
+    def execute_many(self, values: Iterable[int]) -> Any:
+        if np is None:
+            return array("Q", [self.execute(value) for value in values])
+
+        if isinstance(values, np.ndarray):
+            values = values.astype(np.uint64, copy=False)
+        else:
+            # asarray would turn a generator into an object array
+            values = np.fromiter(values, dtype=np.uint64)
+        slots = values % np.uint64(128)
+        inputs = values >> np.uint64(7)
+        seed_block = np.asarray(self.seed_block, dtype=np.uint64)
+
+        # Process each slot's inputs together; the lo and hi passes of a slot
+        # share the same bytecode, so they run as a single doubled batch.
+        result = np.empty_like(values)
+        by_slot = np.argsort(slots, kind="stable")
+        bounds = np.searchsorted(slots[by_slot], np.arange(129, dtype=np.uint64))
+        for idx in range(128):
+            lanes = by_slot[bounds[idx] : bounds[idx + 1]]
+            if len(lanes) == 0:
+                continue
+            inputs_lo = inputs[lanes]
+            inputs_hi = ~inputs_lo & np.uint64(_U32)
+            out = execute_vectorized(
+                self._ensure_program(idx),
+                np.concatenate((inputs_lo, inputs_hi)),
+                seed_block,
+            )
+            result[lanes] = out[len(lanes) :] << np.uint64(32) | out[: len(lanes)]
+        return result
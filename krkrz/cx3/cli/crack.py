@@ -0,0 +1,72 @@
+# SPDX-FileCopyrightText: 2024 yanchan09 <yan@omg.lol>
+#
+# SPDX-License-Identifier: 0BSD
+
+import argparse
+import itertools
+import sys
+from krkrz.cx3.crack import CrackStats, crack, expand_patterns, read_wordlist
+from krkrz.cx3.hashdb import HashDatabase
+from krkrz.cx3.hxv4 import find_table_ref, load_derivator, read_table
+from krkrz.cx3.table import ArchiveTable
+import krkrz.xp3 as xp3
+
+
+def load_table(filename: str, game: None | str) -> ArchiveTable:
+    # An archive, decrypted with the game's keys, or an already decoded table
+    with open(filename, "rb") as f:
+        if not xp3.is_xp3_archive(f):
+            return ArchiveTable(f.read())
+        if game is None:
+            raise Exception("Archives need the game parameters (-g)")
+
+        with xp3.XP3Archive.open(filename) as archive:
+            ref = find_table_ref(archive)
+        keys = load_derivator(game).derive(cached=True)
+        return ArchiveTable(read_table(f, *ref, keys))
+
+
+def print_progress(stats: CrackStats) -> None:
+    print(
+        f"\r{stats.candidates} candidates, {stats.matches} matches,"
+        f" {stats.rate():.0f} cand/s",
+        end="",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="crack")
+    parser.add_argument("filename")
+    parser.add_argument("-g", "--game")
+    parser.add_argument("-d", "--hashdb", required=True)
+    parser.add_argument("--path-key", required=True)
+    parser.add_argument("--file-key", required=True)
+    parser.add_argument("-r", "--regex", action="append", default=[])
+    parser.add_argument("-w", "--wordlist", action="append", default=[])
+    parser.add_argument("-l", "--limit", type=int, default=20)
+    parser.add_argument("-j", "--workers", type=int)
+    # SipHash compression and finalization rounds of path hashes
+    parser.add_argument("--path-rounds", default="4-8")
+    args = parser.parse_args()
+
+    table = load_table(args.filename, args.game)
+    candidates = itertools.chain(
+        expand_patterns(args.regex, args.limit),
+        *(read_wordlist(path) for path in args.wordlist),
+    )
+    stats = crack(
+        candidates,
+        table,
+        bytes.fromhex(args.path_key),
+        bytes.fromhex(args.file_key),
+        HashDatabase(args.hashdb),
+        workers=args.workers,
+        progress=print_progress,
+        path_rounds=tuple(int(n) for n in args.path_rounds.split("-")),  # type: ignore
+    )
+    print(file=sys.stderr)
+    print(
+        f"{stats.candidates} candidates, {stats.matches} matches,"
+        f" {stats.inserted} new, {stats.rate():.0f} cand/s"
+    )
@@ -0,0 +1,15 @@
+# SPDX-FileCopyrightText: 2024 yanchan09 <yan@omg.lol>
+#
+# SPDX-License-Identifier: 0BSD
+
+import argparse
+from krkrz.cx3.hashdb import HashDatabase
+from krkrz.cx3.hashindex import export_index
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="hashexport")
+    parser.add_argument("hashdb")
+    parser.add_argument("output")
+    args = parser.parse_args()
+
+    export_index(HashDatabase(args.hashdb), args.output)
@@ -4,24 +4,60 @@
 
 import argparse
 import json
-from krkrz.cx3.crypt import KeyDerivator
+from krkrz.cx3.crypt import KeyDerivator, derive_many
+
+
+def load_derivators(
+    filename: str, archive_keys: None | list[str]
+) -> list[KeyDerivator]:
+    with open(filename) as f:
+        params = json.load(f)
+
+    # A parameter file may list several archives of the same game
+    if not archive_keys:
+        archive_keys = params.get("archive_unique_keys") or [
+            params["archive_unique_key"]
+        ]
+    return [
+        KeyDerivator.from_params(params, archive_key) for archive_key in archive_keys
+    ]
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(prog="keyderive")
-    parser.add_argument("filename")
+    parser.add_argument("filenames", nargs="+")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("-a", "--archive-key", action="append")
+    parser.add_argument("-b", "--batch", action="store_true")
+    parser.add_argument("-j", "--threads", type=int)
+    parser.add_argument("-p", "--processes", type=int)
     args = parser.parse_args()
 
-    with open(args.filename) as f:
-        params = json.load(f)
+    jobs = [
+        (filename, derivator)
+        for filename in args.filenames
+        for derivator in load_derivators(filename, args.archive_key)
+    ]
 
-    derivator = KeyDerivator(
-        bootstrap_string=params["bootstrap_string"],
-        warning_string=params["warning_string"],
-        params_blob=bytes.fromhex(params["params_blob"]),
-        archive_unique_key=params["archive_unique_key"],
-        upper_key_seed=bytes.fromhex(params["upper_key_seed"]),
-    )
-    keys = derivator.derive()
-    print(f"Key:\t\t{keys.key.hex()}")
-    print(f"Nonce A:\t{keys.nonce_a.hex()}")
-    print(f"Nonce B:\t{keys.nonce_b.hex()}")
+    if args.batch:
+        # One JSON object per line, as soon as each archive's keys are ready
+        results = derive_many(
+            [derivator for _, derivator in jobs], args.threads, args.processes
+        )
+        for (filename, _), (derivator, keys) in zip(jobs, results):
+            line = {
+                "filename": filename,
+                "archive_unique_key": derivator.archive_unique_key,
+                "key": keys.key.hex(),
+                "nonce_a": keys.nonce_a.hex(),
+                "nonce_b": keys.nonce_b.hex(),
+            }
+            print(json.dumps(line), flush=True)
+    else:
+        for filename, derivator in jobs:
+            if len(jobs) > 1:
+                print(f"{filename} ({derivator.archive_unique_key}):")
+            keys = derivator.derive(cached=not args.no_cache)
+            print(f"Key:\t\t{keys.key.hex()}")
+            print(f"Nonce A:\t{keys.nonce_a.hex()}")
+            print(f"Nonce B:\t{keys.nonce_b.hex()}")
@@ -0,0 +1,39 @@
+# SPDX-FileCopyrightText: 2024 yanchan09 <yan@omg.lol>
+#
+# SPDX-License-Identifier: 0BSD
+
+import argparse
+import json
+import sys
+from krkrz.cx3.bytecode import RNGVariant
+from krkrz.cx3.ordersearch import OrderSearch
+
+
+def print_progress(done: int, total: int, found: int) -> None:
+    print(f"\r{done}/{total} tasks, {found} candidates", end="", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="ordersearch")
+    parser.add_argument("filename")
+    parser.add_argument("-j", "--workers", type=int)
+    parser.add_argument("-c", "--checkpoint")
+    args = parser.parse_args()
+
+    # {"rng_variant": "PLUS", "seed_block": [...], "pairs": [[input, output], ...]}
+    with open(args.filename) as f:
+        params = json.load(f)
+
+    search = OrderSearch(
+        pairs=[(int(value), int(expected)) for value, expected in params["pairs"]],
+        rng_variant=RNGVariant[params["rng_variant"]],
+        seed_block=params.get("seed_block", []),
+    )
+    orders = search.run_parallel(
+        workers=args.workers,
+        checkpoint=args.checkpoint,
+        progress=print_progress,
+    )
+    print(file=sys.stderr)
+    for order in orders:
+        print(json.dumps(order))
@@ -3,69 +3,59 @@
 # SPDX-License-Identifier: 0BSD
 
 import argparse
-from krkrz.cx3.hashdb import HashDatabase
-from krkrz.cx3.table import ArchiveTable
+from krkrz.cx3.hashdb import HashDatabase, HashResolver, HashType
+from krkrz.cx3.hashindex import SortedHashIndex, is_index
+from krkrz.cx3.table import ArchiveTable, TableColumns
 import krkrz.xp3 as xp3
-import struct
-import json
-from krkrz.cx3.crypt import KeyDerivator
-import zlib
-from Crypto.Cipher import ChaCha20_Poly1305
+from krkrz.cx3.hxv4 import find_table_ref, load_derivator, read_table
+from krkrz.cx3.tablecache import TableCache
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(prog="tabledump")
     parser.add_argument("filename")
     parser.add_argument("-g", "--game")
     parser.add_argument("-d", "--hashdb")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--preload", action="store_true")
     args = parser.parse_args()
 
-    hdb = None
+    hdb: None | HashResolver = None
     if args.hashdb:
-        hdb = HashDatabase(args.hashdb)
-
+        if is_index(args.hashdb):
+            hdb = SortedHashIndex(args.hashdb)
+        else:
+            hdb = HashDatabase(args.hashdb)
+            if args.preload:
+                hdb.preload(HashType.PATH_SIPHASH_48)
+                hdb.preload(HashType.FILE_BLAKE2S)
+
+    table = None
+    # Columns the streamed paths go into, to be cached afterwards
+    columns = None
+    table_cache = None
     with open(args.filename, "rb") as f:
         if xp3.is_xp3_archive(f):
-            archive = xp3.XP3Archive(f)
-
-            table_ref_chunk = None
-            for chunk_type, chunk_data in archive.index_chunks:
-                if chunk_type == b"Hxv4":
-                    table_ref_chunk = chunk_data
-            if table_ref_chunk is None:
-                raise Exception("Archive doesn't include Hxv4 index chunk")
-
-            offset, size, flag = struct.unpack("<QIH", table_ref_chunk)
+            with xp3.XP3Archive.open(args.filename) as archive:
+                offset, size, flag = find_table_ref(archive)
             print("Hxv4", offset, size, flag)
 
-            f.seek(offset)
-            encrypted_table = f.read(size)
-
-            with open(args.game) as pf:
-                params = json.load(pf)
-
-            derivator = KeyDerivator(
-                bootstrap_string=params["bootstrap_string"],
-                warning_string=params["warning_string"],
-                params_blob=bytes.fromhex(params["params_blob"]),
-                archive_unique_key=params["archive_unique_key"],
-                upper_key_seed=bytes.fromhex(params["upper_key_seed"]),
-            )
-            keys = derivator.derive()
+            if not args.no_cache:
+                table_cache = TableCache.open_default()
+                table = table_cache.load(args.filename, offset)
 
-            nonce = None
-            if flag == 0:
-                nonce = keys.nonce_b
-            elif flag == 1:
-                nonce = keys.nonce_a
-            else:
-                raise Exception("Invalid Hxv4 flag value")
-            cipher = ChaCha20_Poly1305.new(key=keys.key, nonce=nonce)
-            plaintext = cipher.decrypt_and_verify(
-                encrypted_table[16:], encrypted_table[0:16]
-            )
-            data = zlib.decompress(plaintext[4:])
+            if table is None:
+                derivator = load_derivator(args.game)
+                keys = derivator.derive(cached=not args.no_cache)
+                data = read_table(f, offset, size, flag, keys)
+                if table_cache is not None:
+                    columns = TableColumns()
         else:
             data = f.read()
 
-    table = ArchiveTable(data)
-    table.dump(hdb)
+    if table is not None:
+        table.dump(hdb)
+    else:
+        for path in ArchiveTable.iter_paths(data, columns):
+            path.dump(hdb)
+        if table_cache is not None and columns is not None:
+            table_cache.save(args.filename, offset, ArchiveTable.from_columns(columns))
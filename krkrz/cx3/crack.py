@@ -0,0 +1,156 @@
+# SPDX-FileCopyrightText: 2024 yanchan09 <yan@omg.lol>
+#
+# SPDX-License-Identifier: 0BSD
+
+import hashlib
+import itertools
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator
+import exrex
+from krkrz.cx3.crypt import siphash
+from krkrz.cx3.hashdb import HashDatabase, HashType
+from krkrz.cx3.table import ArchiveTable
+
+
+def path_hash(name: str, key: bytes, rounds: tuple[int, int] = (4, 8)) -> bytes:
+    # SipHash with (compression, finalization) rounds, 4-8 by default to
+    # match HashType.PATH_SIPHASH_48
+    value = siphash(key, name.encode("utf-16-le"), *rounds)
+    return value.to_bytes(8, "little")
+
+
+def file_hash(name: str, key: bytes) -> bytes:
+    return hashlib.blake2s(name.encode("utf-16-le"), key=key).digest()
+
+
+def expand_patterns(patterns: Iterable[str], limit: int = 20) -> Iterator[str]:
+    # Every string the regular expressions match, with repetitions capped at
+    # limit
+    for pattern in patterns:
+        yield from exrex.generate(pattern, limit=limit)
+
+
+def read_wordlist(path: str) -> Iterator[str]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            word = line.rstrip("\r\n")
+            if word:
+                yield word
+
+
+# Targets of the worker process, set once by _init_worker instead of being
+# sent along with every batch
+_worker_state: tuple = ()
+
+
+def _init_worker(
+    path_key: bytes,
+    file_key: bytes,
+    path_targets: frozenset[bytes],
+    file_targets: frozenset[bytes],
+    path_rounds: tuple[int, int],
+) -> None:
+    global _worker_state
+    path_size = len(next(iter(path_targets), b""))
+    _worker_state = (
+        path_key,
+        file_key,
+        path_targets,
+        file_targets,
+        path_size,
+        path_rounds,
+    )
+
+
+def _match_batch(candidates: list[str]) -> list[tuple[int, bytes, str]]:
+    path_key, file_key, path_targets, file_targets, path_size, path_rounds = (
+        _worker_state
+    )
+    matches = []
+    for name in candidates:
+        if path_targets:
+            # Tables may hold truncated path hashes
+            hash = path_hash(name, path_key, path_rounds)[:path_size]
+            if hash in path_targets:
+                matches.append((HashType.PATH_SIPHASH_48, hash, name))
+        if file_targets:
+            hash = file_hash(name, file_key)
+            if hash in file_targets:
+                matches.append((HashType.FILE_BLAKE2S, hash, name))
+    return matches
+
+
+class CrackStats:
+    def __init__(self) -> None:
+        self.started = time.monotonic()
+        self.candidates = 0
+        self.matches = 0
+        self.inserted = 0
+
+    def rate(self) -> float:
+        # Candidates per second
+        elapsed = time.monotonic() - self.started
+        return self.candidates / elapsed if elapsed > 0 else 0.0
+
+
+def crack(
+    candidates: Iterable[str],
+    table: ArchiveTable,
+    path_key: bytes,
+    file_key: bytes,
+    hdb: HashDatabase,
+    workers: None | int = None,
+    batch_size: int = 10000,
+    insert_batch: int = 50000,
+    progress: None | Callable[[CrackStats], None] = None,
+    path_rounds: tuple[int, int] = (4, 8),
+) -> CrackStats:
+    # Hashes every candidate both ways in a process pool and stores those
+    # matching a hash of the table
+    path_targets = frozenset(path.hash for path in table.paths)
+    file_targets = frozenset(
+        table.columns.name_hash(i) for i in range(len(table.columns))
+    )
+    workers = workers or os.cpu_count() or 1
+    stats = CrackStats()
+    pending_rows: list[tuple[int, bytes, None | bytes, str]] = []
+    keys = {HashType.PATH_SIPHASH_48: path_key, HashType.FILE_BLAKE2S: file_key}
+
+    def flush() -> None:
+        stats.inserted += hdb.insert_many(pending_rows)
+        pending_rows.clear()
+
+    def collect(count: int, matches: list[tuple[int, bytes, str]]) -> None:
+        stats.candidates += count
+        stats.matches += len(matches)
+        pending_rows.extend(
+            (kind, hash, keys[kind], name) for kind, hash, name in matches
+        )
+        if len(pending_rows) >= insert_batch:
+            flush()
+        if progress is not None:
+            progress(stats)
+
+    candidates = iter(candidates)
+    with ProcessPoolExecutor(
+        workers,
+        initializer=_init_worker,
+        initargs=(path_key, file_key, path_targets, file_targets, path_rounds),
+    ) as executor:
+        # Only a few batches per worker are in flight, so candidates are
+        # generated as fast as they're consumed
+        in_flight: list[tuple[int, Future]] = []
+        while True:
+            batch = list(itertools.islice(candidates, batch_size))
+            if batch:
+                in_flight.append((len(batch), executor.submit(_match_batch, batch)))
+            while in_flight and (len(in_flight) >= workers * 2 or not batch):
+                count, future = in_flight.pop(0)
+                collect(count, future.result())
+            if not batch:
+                break
+
+    flush()
+    return stats
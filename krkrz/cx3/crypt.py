@@ -4,7 +4,11 @@
 
 import hashlib
 import struct
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Iterable, Iterator
 import argon2
+from krkrz._rng import _rotl64
+from krkrz.cx3.keystore import KeyStore
 
 
 def triple32(v: int) -> int:
@@ -18,23 +22,82 @@ def triple32(v: int) -> int:
     return v
 
 
-def fnv_blake(data: bytes, fnvbase: int) -> bytes:
-    fnv_value = ((0x811C9DC5 ^ fnvbase) * 0x01000193) & 0xFFFFFFFF
+def siphash(key: bytes, data: bytes, c_rounds: int = 4, d_rounds: int = 8) -> int:
+    # SipHash-c-d. The defaults are those of SipHash-4-8, the variant
+    # HashType.PATH_SIPHASH_48 is named after.
+    k0, k1 = struct.unpack("<QQ", key)
+    v0 = k0 ^ 0x736F6D6570736575
+    v1 = k1 ^ 0x646F72616E646F6D
+    v2 = k0 ^ 0x6C7967656E657261
+    v3 = k1 ^ 0x7465646279746573
+
+    def rounds(n: int) -> None:
+        nonlocal v0, v1, v2, v3
+        for _ in range(n):
+            v0 = (v0 + v1) & 0xFFFFFFFFFFFFFFFF
+            v1 = _rotl64(v1, 13) ^ v0
+            v0 = _rotl64(v0, 32)
+            v2 = (v2 + v3) & 0xFFFFFFFFFFFFFFFF
+            v3 = _rotl64(v3, 16) ^ v2
+            v0 = (v0 + v3) & 0xFFFFFFFFFFFFFFFF
+            v3 = _rotl64(v3, 21) ^ v0
+            v2 = (v2 + v1) & 0xFFFFFFFFFFFFFFFF
+            v1 = _rotl64(v1, 17) ^ v2
+            v2 = _rotl64(v2, 32)
+
+    tail = len(data) & ~7
+    for (m,) in struct.iter_unpack("<Q", data[:tail]):
+        v3 ^= m
+        rounds(c_rounds)
+        v0 ^= m
+    m = int.from_bytes(data[tail:], "little") | ((len(data) & 0xFF) << 56)
+    v3 ^= m
+    rounds(c_rounds)
+    v0 ^= m
+
+    v2 ^= 0xFF
+    rounds(d_rounds)
+    return v0 ^ v1 ^ v2 ^ v3
+
+
+class FnvBlake:
+    def __init__(self, fnvbase: int, data: bytes = b"") -> None:
+        self.hash_value = ((0x811C9DC5 ^ fnvbase) * 0x01000193) & 0xFFFFFFFF
+        self.position = 0
+        # The 32-byte block every byte's hash gets XORed into, as words
+        self.words = [0] * 8
+        self.blake = hashlib.blake2s()
+        self.update(data)
+
+    def update(self, data: bytes) -> None:
+        self.blake.update(data)
+
+        # triple32 inlined, as this runs once per byte
+        hash_value = self.hash_value
+        position = self.position
+        words = self.words
+        for b in data:
+            v = hash_value ^ b
+            v ^= v >> 17
+            v = (v * 0xED5AD4BB) & 0xFFFFFFFF
+            v ^= v >> 11
+            v = (v * 0xAC4C1B51) & 0xFFFFFFFF
+            v ^= v >> 15
+            v = (v * 0x31848BAB) & 0xFFFFFFFF
+            hash_value = v ^ (v >> 14)
+            words[position] ^= hash_value
+            position = (position + 1) & 7
+        self.hash_value = hash_value
+        self.position = position
+
+    def digest(self) -> bytes:
+        h = self.blake.copy()
+        h.update(struct.pack("<8I", *self.words))
+        return h.digest()
 
-    hash_value = fnv_value
-    out = bytearray([0] * 32)
-    for i, b in enumerate(data):
-        hash_value = triple32(hash_value ^ b)
-        ob = (i * 4) % 32
-        out[ob] ^= (hash_value) & 0xFF
-        out[ob + 1] ^= (hash_value >> 8) & 0xFF
-        out[ob + 2] ^= (hash_value >> 16) & 0xFF
-        out[ob + 3] ^= (hash_value >> 24) & 0xFF
 
-    h = hashlib.blake2s()
-    h.update(data)
-    h.update(out)
-    return h.digest()
+def fnv_blake(data: bytes, fnvbase: int) -> bytes:
+    return FnvBlake(fnvbase, data).digest()
 
 
 class TableKeys:
@@ -52,36 +115,139 @@ class KeyDerivator:
         self.archive_unique_key = kwargs["archive_unique_key"]
         self.upper_key_seed = kwargs["upper_key_seed"]
 
-    def derive(self) -> TableKeys:
-        bootstrap_and_warning = (self.bootstrap_string + self.warning_string).encode(
-            "utf-16-le"
+    @classmethod
+    def from_params(
+        cls, params: dict, archive_unique_key: None | str = None
+    ) -> "KeyDerivator":
+        # From a game parameter file, as loaded from JSON
+        return cls(
+            bootstrap_string=params["bootstrap_string"],
+            warning_string=params["warning_string"],
+            params_blob=bytes.fromhex(params["params_blob"]),
+            archive_unique_key=archive_unique_key or params["archive_unique_key"],
+            upper_key_seed=bytes.fromhex(params["upper_key_seed"]),
         )
 
-        h = hashlib.sha3_224()
-        h.update(self.params_blob)
-        params_hash = h.digest()[0:16]
-
-        lower_key = argon2.low_level.hash_secret_raw(
-            bootstrap_and_warning,
-            params_hash,
-            parallelism=1,
-            time_cost=3,
-            memory_cost=8,
-            hash_len=64,
-            type=argon2.low_level.Type.I,
-        )[0:32]
-        upper_key = fnv_blake(
-            self.upper_key_seed, struct.unpack("<I", self.upper_key_seed[0:4])[0]
+    def digest(self) -> bytes:
+        # Identifies the inputs in a KeyStore
+        h = hashlib.sha256(b"krkrz-tools derived keys v1")
+        for field in [
+            self.bootstrap_string.encode("utf-8"),
+            self.warning_string.encode("utf-8"),
+            self.params_blob,
+            self.archive_unique_key.encode("utf-8"),
+            self.upper_key_seed,
+        ]:
+            h.update(struct.pack("<Q", len(field)))
+            h.update(field)
+        return h.digest()
+
+    def derive(self, cached: bool = False, store: None | KeyStore = None) -> TableKeys:
+        if not cached:
+            return TableKeys(self._derive_buffer())
+
+        if store is None:
+            with KeyStore.open_default() as default_store:
+                return self._derive_stored(default_store)
+        return self._derive_stored(store)
+
+    def _derive_stored(self, store: KeyStore) -> TableKeys:
+        digest = self.digest()
+        buffer = store.get(digest)
+        if buffer is None:
+            buffer = self._derive_buffer()
+            store.put(digest, buffer)
+        return TableKeys(buffer)
+
+    def _game(self) -> tuple:
+        # The inputs shared by every archive of a game
+        return (
+            self.bootstrap_string,
+            self.warning_string,
+            self.params_blob,
+            self.upper_key_seed,
         )
 
-        b0 = fnv_blake(bootstrap_and_warning, 0)
-        b1 = fnv_blake(self.params_blob, 1)
-        b2 = fnv_blake(self.archive_unique_key.encode("utf-16-le"), 2)
+    def _bootstrap_and_warning(self) -> bytes:
+        return (self.bootstrap_string + self.warning_string).encode("utf-16-le")
+
+    def _derive_buffer(self) -> bytes:
+        bootstrap_and_warning = self._bootstrap_and_warning()
+        return combine_keys(
+            derive_lower_key(bootstrap_and_warning, self.params_blob),
+            derive_upper_key(self.upper_key_seed),
+            fnv_blake(bootstrap_and_warning, 0),
+            fnv_blake(self.params_blob, 1),
+            fnv_blake(self.archive_unique_key.encode("utf-16-le"), 2),
+        )
 
-        key_buffer = bytearray(b0 + b1 + b2)
-        for i in range(64):
-            key_buffer[i] ^= lower_key[i % 32]
-        for i in range(64, 96):
-            key_buffer[i] ^= upper_key[i - 64]
 
-        return TableKeys(key_buffer)
+def derive_lower_key(bootstrap_and_warning: bytes, params_blob: bytes) -> bytes:
+    h = hashlib.sha3_224()
+    h.update(params_blob)
+    params_hash = h.digest()[0:16]
+
+    return argon2.low_level.hash_secret_raw(
+        bootstrap_and_warning,
+        params_hash,
+        parallelism=1,
+        time_cost=3,
+        memory_cost=8,
+        hash_len=64,
+        type=argon2.low_level.Type.I,
+    )[0:32]
+
+
+def derive_upper_key(upper_key_seed: bytes) -> bytes:
+    return fnv_blake(upper_key_seed, struct.unpack("<I", upper_key_seed[0:4])[0])
+
+
+def combine_keys(
+    lower_key: bytes, upper_key: bytes, b0: bytes, b1: bytes, b2: bytes
+) -> bytes:
+    key_buffer = bytearray(b0 + b1 + b2)
+    for i in range(64):
+        key_buffer[i] ^= lower_key[i % 32]
+    for i in range(64, 96):
+        key_buffer[i] ^= upper_key[i - 64]
+
+    return bytes(key_buffer)
+
+
+def derive_many(
+    derivators: Iterable[KeyDerivator],
+    threads: None | int = None,
+    processes: None | int = None,
+) -> Iterator[tuple[KeyDerivator, TableKeys]]:
+    # Derives keys for many archives at once, in the order given. argon2
+    # releases the GIL, so it runs on threads, while fnv_blake gets a process
+    # pool. Everything but the archive unique key is derived once per game.
+    derivators = list(derivators)
+    with (
+        ThreadPoolExecutor(threads) as thread_pool,
+        ProcessPoolExecutor(processes) as process_pool,
+    ):
+        games: dict[tuple, tuple[Future, ...]] = {}
+        for derivator in derivators:
+            game = derivator._game()
+            if game in games:
+                continue
+            bootstrap_and_warning = derivator._bootstrap_and_warning()
+            games[game] = (
+                thread_pool.submit(
+                    derive_lower_key, bootstrap_and_warning, derivator.params_blob
+                ),
+                process_pool.submit(derive_upper_key, derivator.upper_key_seed),
+                process_pool.submit(fnv_blake, bootstrap_and_warning, 0),
+                process_pool.submit(fnv_blake, derivator.params_blob, 1),
+            )
+        archives = [
+            process_pool.submit(
+                fnv_blake, derivator.archive_unique_key.encode("utf-16-le"), 2
+            )
+            for derivator in derivators
+        ]
+
+        for derivator, b2 in zip(derivators, archives):
+            shared = [future.result() for future in games[derivator._game()]]
+            yield derivator, TableKeys(combine_keys(*shared, b2.result()))
@@ -2,7 +2,14 @@
 #
 # SPDX-License-Identifier: 0BSD
 
+import pathlib
 import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Iterable, Protocol, Sequence
+
+# Hashes per SELECT in resolve_many, below SQLite's default variable limit
+_RESOLVE_CHUNK = 500
 
 
 class HashType:
@@ -10,25 +17,219 @@ class HashType:
     FILE_BLAKE2S = 2
 
 
+class HashResolver(Protocol):
+    def resolve_hash(self, kind: int, hash: bytes) -> None | str: ...
+
+    def resolve_many(self, kind: int, hashes: Iterable[bytes]) -> dict[bytes, str]: ...
+
+
 class HashDatabase:
-    def __init__(self, path: str) -> None:
-        self.conn = sqlite3.connect(path)
+    # Safe to share between threads. Every thread reads through its own
+    # read-only connection, while writes go through a single connection in
+    # autocommit mode. The database is switched to WAL journaling so readers
+    # don't wait for the writer.
+    def __init__(
+        self,
+        path: str,
+        cache_size: int = 65536,
+        mmap_size: int = 1 << 28,
+        page_cache_kib: int = 16384,
+        write_batch: int = 10000,
+    ) -> None:
+        # Recently resolved hashes, including unknown ones as None
+        self.cache: OrderedDict[tuple[int, bytes], None | str] = OrderedDict()
+        self.cache_size = cache_size
+        self.cache_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Every known hash of the preloaded kinds
+        self.preloaded: dict[int, dict[bytes, str]] = {}
+        # Bumped whenever the cache is cleared, so results of queries that
+        # raced an insert don't get cached
+        self.generation = 0
+
+        self.path = path
+        self.pragmas = (
+            f"PRAGMA mmap_size = {int(mmap_size)};"
+            f" PRAGMA cache_size = {-int(page_cache_kib)};"
+        )
+        self.readers: list[sqlite3.Connection] = []
+        self.readers_lock = threading.Lock()
+        self.local = threading.local()
+        # Rows queued by queue_insert, written once there are write_batch
+        self.write_batch = write_batch
+        self.pending: list[tuple[int, bytes, None | bytes, str]] = []
+        self.pending_lock = threading.Lock()
+
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
         self.cursor = self.conn.cursor()
+        self.write_lock = threading.Lock()
 
         self.cursor.executescript(
-            """
+            f"""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            {self.pragmas}
             CREATE TABLE IF NOT EXISTS known_hashes (type, hash, key, value, extra, UNIQUE(type, hash));
             """
         )
 
+    def _reader(self) -> None | sqlite3.Connection:
+        # The calling thread's read-only connection. In-memory databases
+        # can't be opened twice, so they are read through the writer.
+        if self.path == ":memory:" or self.path.startswith("file:"):
+            return None
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            uri = pathlib.Path(self.path).absolute().as_uri() + "?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            conn.executescript(self.pragmas)
+            self.local.conn = conn
+            with self.readers_lock:
+                self.readers.append(conn)
+        return conn
+
+    def _query(self, sql: str, parameters: Sequence) -> list:
+        conn = self._reader()
+        if conn is None:
+            with self.write_lock:
+                return self.conn.execute(sql, parameters).fetchall()
+        return conn.execute(sql, parameters).fetchall()
+
+    def close(self) -> None:
+        self.flush()
+        with self.readers_lock:
+            for conn in self.readers:
+                conn.close()
+            self.readers.clear()
+        self.local = threading.local()
+        with self.write_lock:
+            self.conn.close()
+
+    def insert_many(self, rows: Iterable[tuple[int, bytes, None | bytes, str]]) -> int:
+        # Adds (kind, hash, key, value) rows in a single transaction, keeping
+        # existing ones, and returns how many were new
+        with self.write_lock:
+            before = self.conn.total_changes
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO known_hashes (type, hash, key, value)"
+                    " VALUES (?, ?, ?, ?)",
+                    (
+                        (kind, hash, key, value.encode("utf-16-le"))
+                        for kind, hash, key, value in rows
+                    ),
+                )
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+            inserted = self.conn.total_changes - before
+        # Cached misses may have become known
+        self.clear_cache()
+        return inserted
+
+    def queue_insert(self, rows: Iterable[tuple[int, bytes, None | bytes, str]]) -> int:
+        # Like insert_many, but rows from any number of threads are collected
+        # and written together. Returns how many rows this call wrote.
+        with self.pending_lock:
+            self.pending.extend(rows)
+            if len(self.pending) < self.write_batch:
+                return 0
+        return self.flush()
+
+    def flush(self) -> int:
+        with self.pending_lock:
+            rows, self.pending = self.pending, []
+        if not rows:
+            return 0
+        return self.insert_many(rows)
+
+    def preload(self, kind: int) -> None:
+        generation = self.generation
+        rows = self._query(
+            "SELECT hash, value FROM known_hashes WHERE type = ?", (kind,)
+        )
+        preloaded = {hash: decode_value(value) for hash, value in rows}
+        with self.cache_lock:
+            if self.generation == generation:
+                self.preloaded[kind] = preloaded
+
+    def clear_cache(self) -> None:
+        with self.cache_lock:
+            self.generation += 1
+            self.cache.clear()
+            self.preloaded.clear()
+
+    def _cache_get(self, key: tuple[int, bytes]) -> tuple[bool, None | str]:
+        with self.cache_lock:
+            preloaded = self.preloaded.get(key[0])
+            if preloaded is not None:
+                self.hits += 1
+                return True, preloaded.get(key[1])
+            if key in self.cache:
+                self.hits += 1
+                self.cache.move_to_end(key)
+                return True, self.cache[key]
+            self.misses += 1
+            return False, None
+
+    def _cache_put(
+        self, key: tuple[int, bytes], value: None | str, generation: int
+    ) -> None:
+        # generation is the one from before the value was queried
+        if self.cache_size <= 0:
+            return
+        with self.cache_lock:
+            if self.generation != generation:
+                return
+            self.cache[key] = value
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
     def resolve_hash(self, kind: int, hash: bytes) -> None | str:
-        self.cursor.execute(
-            "SELECT value FROM known_hashes WHERE type = ? AND hash = ?", (kind, hash)
+        key = (kind, bytes(hash))
+        cached, value = self._cache_get(key)
+        if cached:
+            return value
+
+        generation = self.generation
+        rows = self._query(
+            "SELECT value FROM known_hashes WHERE type = ? AND hash = ?", key
         )
-        maybe_result = self.cursor.fetchone()
-        if maybe_result is None:
-            return None
-        elif maybe_result[0] is None:
-            return ""
-        else:
-            return maybe_result[0].decode("utf-16-le", "replace")
+        value = None if not rows else decode_value(rows[0][0])
+        self._cache_put(key, value, generation)
+        return value
+
+    def resolve_many(self, kind: int, hashes: Iterable[bytes]) -> dict[bytes, str]:
+        # Resolves hashes with one query per chunk, leaving out unknown ones
+        resolved = {}
+        unique = []
+        for hash in {bytes(hash) for hash in hashes}:
+            cached, value = self._cache_get((kind, hash))
+            if not cached:
+                unique.append(hash)
+            elif value is not None:
+                resolved[hash] = value
+
+        for i in range(0, len(unique), _RESOLVE_CHUNK):
+            chunk = unique[i : i + _RESOLVE_CHUNK]
+            placeholders = ", ".join("?" * len(chunk))
+            generation = self.generation
+            rows = self._query(
+                "SELECT hash, value FROM known_hashes"
+                f" WHERE type = ? AND hash IN ({placeholders})",
+                (kind, *chunk),
+            )
+            found = {hash: decode_value(value) for hash, value in rows}
+            for hash in chunk:
+                self._cache_put((kind, hash), found.get(hash), generation)
+            resolved.update(found)
+        return resolved
+
+
+def decode_value(value: None | bytes) -> str:
+    if value is None:
+        return ""
+    return value.decode("utf-16-le", "replace")
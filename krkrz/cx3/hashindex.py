@@ -0,0 +1,208 @@
+# SPDX-FileCopyrightText: 2024 yanchan09 <yan@omg.lol>
+#
+# SPDX-License-Identifier: 0BSD
+
+import mmap
+import os
+import struct
+from typing import Any, Iterable
+from krkrz.cx3.hashdb import HashDatabase, decode_value
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Magic, version and number of hash kinds
+_HEADER = struct.Struct("<4sII")
+# Kind, hash width, record count and offset of the records
+_SECTION = struct.Struct("<IIQQ")
+# Offset and length of the value in the string heap, following the hash
+_RECORD = struct.Struct("<QI")
+# Marks a NULL value
+_NULL = 0xFFFFFFFF
+
+MAGIC = b"KRHX"
+VERSION = 1
+
+
+def export_index(hdb: HashDatabase, path: str) -> None:
+    # Writes known_hashes as one sorted array of fixed-width records per hash
+    # kind, followed by a heap holding the values
+    cursor = hdb.conn.cursor()
+    cursor.execute(
+        "SELECT type, COUNT(*), MIN(LENGTH(hash)), MAX(LENGTH(hash))"
+        " FROM known_hashes GROUP BY type ORDER BY type"
+    )
+    kinds = cursor.fetchall()
+
+    sections = []
+    offset = _HEADER.size + _SECTION.size * len(kinds)
+    for kind, count, min_width, max_width in kinds:
+        if min_width != max_width:
+            raise Exception(f"Hashes of kind {kind} differ in length")
+        sections.append((kind, max_width, count, offset))
+        offset += (max_width + _RECORD.size) * count
+    heap_start = offset
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(sections)))
+        f.writelines(_SECTION.pack(*section) for section in sections)
+
+    # Records and the heap get written side by side through two handles
+    with open(tmp_path, "r+b") as records, open(tmp_path, "r+b") as heap:
+        heap.seek(heap_start)
+        heap_offset = 0
+        for kind, _, _, records_offset in sections:
+            records.seek(records_offset)
+            # BLOBs sort like bytes
+            cursor.execute(
+                "SELECT hash, value FROM known_hashes WHERE type = ? ORDER BY hash",
+                (kind,),
+            )
+            for hash, value in cursor:
+                if value is None:
+                    records.write(hash + _RECORD.pack(0, _NULL))
+                    continue
+                records.write(hash + _RECORD.pack(heap_offset, len(value)))
+                heap.write(value)
+                heap_offset += len(value)
+    os.replace(tmp_path, path)
+
+
+def is_index(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(4) == MAGIC
+
+
+class SortedHashIndex:
+    # Read-only HashDatabase backend over an exported index. The file is
+    # mapped, so processes reading the same index share its pages.
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, kind_count = _HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION:
+            raise Exception("Unsupported hash index file")
+
+        self.sections: dict[int, tuple[int, int, int]] = {}
+        heap_start = _HEADER.size + _SECTION.size * kind_count
+        for i in range(kind_count):
+            kind, width, count, offset = _SECTION.unpack_from(
+                self.data, _HEADER.size + _SECTION.size * i
+            )
+            self.sections[kind] = (width, count, offset)
+            heap_start = max(heap_start, offset + (width + _RECORD.size) * count)
+        self.heap_start = heap_start
+        # Leading 8 bytes of every hash of a kind as native integers, for
+        # resolve_many to search with NumPy
+        self.prefixes: dict[int, Any] = {}
+
+    def _find(self, kind: int, hash: bytes) -> None | int:
+        # Offset of the record for hash. Hashes are close to uniformly
+        # distributed, so the search interpolates on their leading bytes
+        # before falling back to bisection.
+        section = self.sections.get(kind)
+        if section is None:
+            return None
+        width, count, offset = section
+        if len(hash) != width or count == 0:
+            return None
+        stride = width + _RECORD.size
+        data = self.data
+
+        def key(i: int) -> bytes:
+            return data[offset + i * stride : offset + i * stride + width]
+
+        prefix = min(width, 8)
+        target = int.from_bytes(hash[:prefix], "big")
+        lo, hi = 0, count - 1
+        steps = 0
+        while lo <= hi:
+            lo_key, hi_key = key(lo), key(hi)
+            if hash < lo_key or hash > hi_key:
+                return None
+            lo_value = int.from_bytes(lo_key[:prefix], "big")
+            hi_value = int.from_bytes(hi_key[:prefix], "big")
+            if steps < 8 and hi_value > lo_value:
+                mid = lo + (hi - lo) * (target - lo_value) // (hi_value - lo_value)
+            else:
+                mid = (lo + hi) // 2
+            steps += 1
+
+            mid_key = key(mid)
+            if mid_key == hash:
+                return offset + mid * stride + width
+            elif mid_key < hash:
+                lo = mid + 1
+            else:
+                hi = mid - 1
+        return None
+
+    def resolve_hash(self, kind: int, hash: bytes) -> None | str:
+        record = self._find(kind, bytes(hash))
+        if record is None:
+            return None
+        value_offset, length = _RECORD.unpack_from(self.data, record)
+        if length == _NULL:
+            return decode_value(None)
+        start = self.heap_start + value_offset
+        return decode_value(self.data[start : start + length])
+
+    def _prefixes(self, kind: int) -> Any:
+        prefixes = self.prefixes.get(kind)
+        if prefixes is None:
+            width, count, offset = self.sections[kind]
+            stride = width + _RECORD.size
+            view = np.ndarray(
+                (count,), ">u8", buffer=self.data, offset=offset, strides=(stride,)
+            )
+            prefixes = view.astype(np.uint64)
+            self.prefixes[kind] = prefixes
+        return prefixes
+
+    def resolve_many(self, kind: int, hashes: Iterable[bytes]) -> dict[bytes, str]:
+        unique = {bytes(hash) for hash in hashes}
+        section = self.sections.get(kind)
+        if np is None or section is None or section[0] < 8 or section[1] == 0:
+            resolved = {}
+            for hash in unique:
+                value = self.resolve_hash(kind, hash)
+                if value is not None:
+                    resolved[hash] = value
+            return resolved
+
+        # Every hash is located with one vectorized binary search on its
+        # first 8 bytes, and only the candidates get compared in full
+        width, count, offset = section
+        stride = width + _RECORD.size
+        candidates = [hash for hash in unique if len(hash) == width]
+        targets = np.frombuffer(
+            b"".join(hash[:8] for hash in candidates), ">u8"
+        ).astype(np.uint64)
+        prefixes = self._prefixes(kind)
+        positions = np.minimum(np.searchsorted(prefixes, targets), count - 1)
+        found = np.flatnonzero(prefixes[positions] == targets)
+
+        data = self.data
+        heap_start = self.heap_start
+        unpack_record = _RECORD.unpack_from
+        resolved = {}
+        for i, position in zip(found.tolist(), positions[found].tolist()):
+            hash = candidates[i]
+            record = offset + position * stride
+            if data[record : record + width] != hash:
+                # Another hash shares the prefix
+                value = self.resolve_hash(kind, hash)
+                if value is not None:
+                    resolved[hash] = value
+                continue
+            value_offset, length = unpack_record(data, record + width)
+            if length == _NULL:
+                resolved[hash] = decode_value(None)
+            else:
+                start = heap_start + value_offset
+                resolved[hash] = decode_value(data[start : start + length])
+        return resolved
@@ -0,0 +1,87 @@
+# SPDX-FileCopyrightText: 2024 yanchan09 <yan@omg.lol>
+#
+# SPDX-License-Identifier: 0BSD
+
+import io
+import json
+import struct
+import zlib
+from Crypto.Cipher import ChaCha20_Poly1305
+from krkrz.cx3.crypt import KeyDerivator, TableKeys
+from krkrz.xp3 import XP3Archive
+
+
+def parse_table_ref(chunk: bytes) -> tuple[int, int, int]:
+    # Offset, size and flag of the encrypted table an Hxv4 index chunk
+    # points to
+    offset, size, flag = struct.unpack("<QIH", chunk)
+    return offset, size, flag
+
+
+def find_table_ref(archive: XP3Archive) -> tuple[int, int, int]:
+    chunk = archive.get_chunk(b"Hxv4")
+    if chunk is None:
+        raise Exception("Archive doesn't include Hxv4 index chunk")
+    return parse_table_ref(chunk)
+
+
+def load_derivator(game: str) -> KeyDerivator:
+    # Key derivator for the archive named in a game parameter file
+    with open(game) as f:
+        return KeyDerivator.from_params(json.load(f))
+
+
+def read_table(
+    file: io.BufferedIOBase,
+    offset: int,
+    size: int,
+    flag: int,
+    keys: TableKeys,
+    chunk_size: int = 1 << 16,
+) -> bytearray:
+    # Decrypts and decompresses the table chunk by chunk, so only the decoded
+    # table is ever held in full. The tag is verified before anything is
+    # returned.
+    if flag == 0:
+        nonce = keys.nonce_b
+    elif flag == 1:
+        nonce = keys.nonce_a
+    else:
+        raise Exception("Invalid Hxv4 flag value")
+    cipher = ChaCha20_Poly1305.new(key=keys.key, nonce=nonce)
+    decompressor = zlib.decompressobj()
+
+    file.seek(offset)
+    tag = file.read(16)
+    remaining = size - 16
+    # The plaintext starts with 4 bytes ahead of the zlib stream
+    header_remaining = 4
+    data = bytearray()
+    # A tampered table may well fail to decompress, but that's only reported
+    # after the tag has been checked.
+    decompress_error = None
+    while remaining > 0:
+        encrypted = file.read(min(chunk_size, remaining))
+        if not encrypted:
+            raise Exception("Unexpected end of file in Hxv4 table")
+        remaining -= len(encrypted)
+
+        plaintext = cipher.decrypt(encrypted)
+        if header_remaining:
+            skipped = min(header_remaining, len(plaintext))
+            plaintext = plaintext[skipped:]
+            header_remaining -= skipped
+        if decompress_error is None:
+            try:
+                data += decompressor.decompress(plaintext)
+            except zlib.error as e:
+                decompress_error = e
+
+    cipher.verify(tag)
+    if decompress_error is not None:
+        raise decompress_error
+    data += decompressor.flush()
+    if not decompressor.eof:
+        raise Exception("Truncated zlib stream in Hxv4 table")
+    # Returned as is, as a copy would double the peak memory use
+    return data
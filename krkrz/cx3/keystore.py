@@ -0,0 +1,101 @@
+# SPDX-FileCopyrightText: 2024 yanchan09 <yan@omg.lol>
+#
+# SPDX-License-Identifier: 0BSD
+
+import os
+import sqlite3
+import time
+
+
+class KeyStore:
+    # Derived key buffers, keyed by a digest of the derivation inputs
+    def __init__(
+        self,
+        path: str,
+        max_age: None | float = None,
+        max_entries: None | int = None,
+    ) -> None:
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.conn = sqlite3.connect(path)
+        self.cursor = self.conn.cursor()
+
+        self.cursor.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS derived_keys (digest PRIMARY KEY, buffer, created, accessed);
+            """
+        )
+
+    @staticmethod
+    def default_path() -> str:
+        path = os.environ.get("KRKRZ_KEYSTORE")
+        if path:
+            return path
+        cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+        return os.path.join(cache_dir, "krkrz-tools", "keys.db")
+
+    @classmethod
+    def open_default(
+        cls, max_age: None | float = None, max_entries: None | int = 1024
+    ) -> "KeyStore":
+        path = cls.default_path()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        return cls(path, max_age, max_entries)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> "KeyStore":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def get(self, digest: bytes) -> None | bytes:
+        self.cursor.execute(
+            "SELECT buffer, created FROM derived_keys WHERE digest = ?", (digest,)
+        )
+        maybe_result = self.cursor.fetchone()
+        if maybe_result is None:
+            return None
+        buffer, created = maybe_result
+        now = time.time()
+        if self.max_age is not None and now - created > self.max_age:
+            return None
+
+        self.cursor.execute(
+            "UPDATE derived_keys SET accessed = ? WHERE digest = ?", (now, digest)
+        )
+        self.conn.commit()
+        return buffer
+
+    def put(self, digest: bytes, buffer: bytes) -> None:
+        now = time.time()
+        self.cursor.execute(
+            "INSERT OR REPLACE INTO derived_keys VALUES (?, ?, ?, ?)",
+            (digest, buffer, now, now),
+        )
+        self.evict()
+        self.conn.commit()
+
+    def evict(self) -> None:
+        # Drops entries older than max_age, then the least recently used ones
+        # beyond max_entries
+        if self.max_age is not None:
+            self.cursor.execute(
+                "DELETE FROM derived_keys WHERE created < ?",
+                (time.time() - self.max_age,),
+            )
+        if self.max_entries is not None:
+            self.cursor.execute(
+                """
+                DELETE FROM derived_keys WHERE digest NOT IN
+                (SELECT digest FROM derived_keys ORDER BY accessed DESC LIMIT ?)
+                """,
+                (self.max_entries,),
+            )
+        self.conn.commit()
+
+    def __len__(self) -> int:
+        self.cursor.execute("SELECT COUNT(*) FROM derived_keys")
+        return self.cursor.fetchone()[0]
@@ -0,0 +1,668 @@
+# SPDX-FileCopyrightText: 2024 yanchan09 <yan@omg.lol>
+#
+# SPDX-License-Identifier: 0BSD
+
+import hashlib
+import itertools
+import json
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Iterator
+
+from krkrz.cx3.bytecode import (
+    _COMPILER_TEMPLATES,
+    INSTRUCTION_COSTS,
+    BytecodeEmitter,
+    BytecodeTooLargeException,
+    Instruction,
+    RNGVariant,
+    slot_seed,
+)
+
+# What BytecodeEmitter appends for each entry of the order table, as
+# (instruction, fixed argument, whether a random argument gets drawn).
+ORDER_INSTRUCTIONS = [
+    (Instruction.BITWISE_NOT, 0, False),
+    (Instruction.NEGATE, 0, False),
+    (Instruction.ADD_ONE, 0, False),
+    (Instruction.SUBTRACT_ONE, 0, False),
+    (Instruction.SHUFFLE, 0xAAAAAAAA, False),
+    (Instruction.BITWISE_XOR, 0, True),
+    (None, 0, True),  # SUBTRACT_ARG or ADD_ARG, decided by an extra draw
+    (Instruction.LOAD_FROM_BUFFER_INDIRECT, 0x3FF, False),
+    (Instruction.ADD_CONTEXT, 0, False),
+    (Instruction.SUBTRACT_CONTEXT, 0, False),
+    (Instruction.SUBTRACT_FROM_CONTEXT, 0, False),
+    (Instruction.MULTIPLY_CONTEXT, 0, False),
+    (Instruction.SHL_CONTEXT, 0, False),
+    (Instruction.SHR_CONTEXT, 0, False),
+    (Instruction.LOAD_ARG, 0, True),
+    (Instruction.LOAD_INPUT, 0, False),
+    (Instruction.LOAD_FROM_BUFFER, 0, True),
+]
+
+# Index ranges of the opcode groups within the order table
+ORDER_GROUPS = [range(0, 8), range(8, 14), range(14, 17)]
+_INNER, _SUBROUTINE, _FINAL = range(3)
+
+# For every group and every value drawn in it, the order table indices that
+# value may still stand for
+Domains = tuple[tuple[frozenset[int], ...], ...]
+
+
+def _stream_class(idx: int) -> int:
+    # Entries whose instructions consume the RNG stream differently lead to
+    # different bytecode afterwards, so the search has to tell them apart.
+    if idx == 5:
+        return 1
+    elif idx == 6:
+        return 2
+    elif idx == 15:
+        return 3
+    return 0
+
+
+# Cost of the instruction each entry of the order table appends
+_INDEX_COSTS = [
+    1 if ty is None else INSTRUCTION_COSTS[ty] for ty, _, _ in ORDER_INSTRUCTIONS
+]
+
+
+def _has_matching(domains: tuple[frozenset[int], ...]) -> bool:
+    # Whether every value of a group can still get a distinct index
+    owner: dict[int, int] = {}
+
+    def augment(val: int, seen: set[int]) -> bool:
+        for idx in domains[val]:
+            if idx in seen:
+                continue
+            seen.add(idx)
+            if idx not in owner or augment(owner[idx], seen):
+                owner[idx] = val
+                return True
+        return False
+
+    return all(augment(val, set()) for val in range(len(domains)))
+
+
+def _refine(domains: Domains, group: int, val: int, allowed: frozenset[int]) -> Domains:
+    updated = list(domains[group])
+    updated[val] = allowed
+    return domains[:group] + (tuple(updated),) + domains[group + 1 :]
+
+
+# Outcomes of the cost limit checks that depended on undecided entries, keyed
+# by (rounds, check number) within the slot being emitted
+Decisions = frozenset[tuple[tuple[int, int], bool]]
+
+# Search progress: constraints on the order table plus the slot's decisions
+State = tuple[Domains, Decisions]
+
+
+class _Branch(Exception):
+    def __init__(self, group: int, val: int, parts: list[frozenset[int]]) -> None:
+        self.group = group
+        self.val = val
+        self.parts = parts
+
+
+class _CostBranch(Exception):
+    def __init__(self, key: tuple[int, int]) -> None:
+        self.key = key
+
+
+class _SymbolicEmitter:
+    # Mirrors BytecodeEmitter.emit step for step, but with a partially known
+    # order table. Values whose instruction doesn't change the RNG stream are
+    # emitted as symbolic entries listing every instruction they may stand
+    # for. Cost limit checks that depend on those follow the given decisions
+    # and are recorded for _resolve to verify. Anything else that depends on
+    # an undecided entry raises _Branch or _CostBranch.
+    def __init__(
+        self,
+        seed: int,
+        rng_variant: RNGVariant,
+        domains: Domains,
+        decisions: Decisions,
+    ) -> None:
+        self.emitter = BytecodeEmitter(seed, [], rng_variant)
+        self.domains = domains
+        self.decisions = dict(decisions)
+        self.checks: list[tuple[int, int, Counter, bool]] = []
+
+    def emit(self, max_cost: int = 128) -> list:
+        self.max_cost = max_cost
+        for rounds in range(5, 0, -1):
+            self.rounds = rounds
+            self.program: list = []
+            self.fixed_cost = 0
+            self.cost_lo = 0
+            self.cost_hi = 0
+            self.cost_checks = 0
+            try:
+                self._add_cost(9)
+                self._emit_subroutine(rounds)
+                self._append(Instruction.RETURN)
+                self._add_cost(5)
+                return self.program
+            except BytecodeTooLargeException:
+                continue
+        raise Exception("Failed to generate bytecode")
+
+    def _add_cost(self, cost: int) -> None:
+        self.fixed_cost += cost
+        self.cost_lo += cost
+        self.cost_hi += cost
+        self._check_cost()
+
+    def _add_symbol(self, entry: tuple) -> None:
+        self.program.append(entry)
+        costs = [cost for cost, _ in entry[3].values()]
+        self.cost_lo += min(costs)
+        self.cost_hi += max(costs)
+        self._check_cost()
+
+    def _check_cost(self) -> None:
+        self.cost_checks += 1
+        if self.cost_lo > self.max_cost:
+            raise BytecodeTooLargeException()
+        elif self.cost_hi <= self.max_cost:
+            return
+
+        key = (self.rounds, self.cost_checks)
+        if key not in self.decisions:
+            raise _CostBranch(key)
+        counts = Counter(entry[1:3] for entry in self.program if entry[0] == "s")
+        overflow = self.decisions[key]
+        if not overflow and self.checks and self.checks[-1][0] == self.rounds:
+            # Costs only grow within a round, so this check implies the last
+            if not self.checks[-1][3]:
+                self.checks.pop()
+        self.checks.append((self.rounds, self.fixed_cost, counts, overflow))
+        if overflow:
+            raise BytecodeTooLargeException()
+
+    def _append(self, ty: Instruction, arg: int = 0) -> None:
+        self.program.append(("c", ty, arg))
+        self._add_cost(INSTRUCTION_COSTS[ty])
+
+    def _draw_symbol(self, group: int, modulus: int) -> tuple[int, frozenset[int]]:
+        val = self.emitter._rnd32() % modulus
+        domain = self.domains[group][val]
+        classes: dict[int, set[int]] = {}
+        for idx in domain:
+            classes.setdefault(_stream_class(idx), set()).add(idx)
+        if len(classes) > 1:
+            raise _Branch(group, val, [frozenset(c) for c in classes.values()])
+        return val, domain
+
+    def _append_symbol(self, group: int, val: int, domain: frozenset[int]) -> None:
+        # All candidates share a stream class, so either all or none of them
+        # draw an argument.
+        options = {}
+        for idx in domain:
+            ty, arg, _ = ORDER_INSTRUCTIONS[idx]
+            options[idx] = (INSTRUCTION_COSTS[ty], (ty, arg))
+        self._add_symbol(("s", group, val, options))
+
+        if ORDER_INSTRUCTIONS[next(iter(domain))][2]:
+            raw = self.emitter._rnd32()
+            for idx, (cost, (ty, _)) in options.items():
+                arg = raw & 0x3FF if ty == Instruction.LOAD_FROM_BUFFER else raw
+                options[idx] = (cost, (ty, arg))
+            self._add_cost(4)
+
+    def _emit_final(self) -> None:
+        val, domain = self._draw_symbol(_FINAL, 3)
+        self._append_symbol(_FINAL, val, domain)
+
+    def _emit_subroutine(self, step: int) -> None:
+        if step == 1:
+            return self._emit_final()
+
+        self._append(Instruction.SUBROUTINE)
+        if self.emitter._rnd32() % 2 == 0:
+            self._emit_inner(step - 1)
+        else:
+            self._emit_subroutine(step - 1)
+
+        self._append(Instruction.SAVE_TO_CONTEXT)
+        if self.emitter._rnd32() % 2 == 0:
+            self._emit_inner(step - 1)
+        else:
+            self._emit_subroutine(step - 1)
+
+        val, domain = self._draw_symbol(_SUBROUTINE, 6)
+        self._append_symbol(_SUBROUTINE, val, domain)
+        self._append(Instruction.RETURN)
+
+    def _emit_inner(self, step: int) -> None:
+        if step == 1:
+            return self._emit_final()
+
+        if self.emitter._rnd32() % 2 == 0:
+            self._emit_inner(step - 1)
+        else:
+            self._emit_subroutine(step - 1)
+
+        val, domain = self._draw_symbol(_INNER, 8)
+        if _stream_class(next(iter(domain))) != 2:
+            return self._append_symbol(_INNER, val, domain)
+
+        # SUBTRACT_ARG/ADD_ARG draws its direction before the argument
+        if self.emitter._rnd32() % 2 == 0:
+            ty = Instruction.SUBTRACT_ARG
+        else:
+            ty = Instruction.ADD_ARG
+        options = {6: (1, (ty, 0))}
+        self._add_symbol(("s", _INNER, val, options))
+        options[6] = (1, (ty, self.emitter._rnd32()))
+        self._add_cost(4)
+
+
+_op_cache: dict[tuple[Instruction, int], Callable] = {}
+
+
+def _op_function(ty: Instruction, arg: int) -> Callable:
+    # A single instruction as a function of (value, context, seed block, input)
+    key = (ty, arg)
+    if key not in _op_cache:
+        namespace: dict = {}
+        statement = _COMPILER_TEMPLATES[ty].format(arg=int(arg), ctx="c")
+        # Generated from _COMPILER_TEMPLATES and an integer argument only
+        exec(  # noqa: S102
+            f"def op(v, c, seed_block, input):\n    {statement}\n    return v",
+            namespace,
+        )
+        _op_cache[key] = namespace["op"]
+    return _op_cache[key]
+
+
+def _compile_symbolic(program: list) -> Callable:
+    # Like compile_bytecode, but each symbolic entry calls the function at
+    # its position in a tuple of instructions passed in at run time.
+    lines = ["def bytecode(input, seed_block, ops):", "    v = 0", "    c0 = 0"]
+    depth = 0
+    symbol = 0
+    for entry in program:
+        if entry[0] == "s":
+            lines.append(f"    v = ops[{symbol}](v, c{depth}, seed_block, input)")
+            symbol += 1
+            continue
+        _, ty, arg = entry
+        if ty == Instruction.SUBROUTINE:
+            depth += 1
+            lines.append(f"    c{depth} = 0")
+        elif ty == Instruction.RETURN:
+            depth -= 1
+            if depth < 0:
+                break
+        else:
+            lines.append(
+                "    " + _COMPILER_TEMPLATES[ty].format(arg=int(arg), ctx=f"c{depth}")
+            )
+    lines.append("    return v")
+
+    # As in compile_bytecode, the source is generated internally
+    namespace: dict = {}
+    exec("\n".join(lines), namespace)  # noqa: S102
+    return namespace["bytecode"]
+
+
+def _assignments(
+    domains: tuple[frozenset[int], ...], vals: list[int]
+) -> Iterator[dict[int, int]]:
+    # Distinct indices for the given values of a group that still leave a
+    # valid permutation for the remaining ones
+    def assign(i: int, current: dict[int, int]) -> Iterator[dict[int, int]]:
+        if i == len(vals):
+            pinned = list(domains)
+            for val, idx in current.items():
+                pinned[val] = frozenset([idx])
+            if _has_matching(tuple(pinned)):
+                yield dict(current)
+            return
+        taken = set(current.values())
+        for idx in sorted(domains[vals[i]]):
+            if idx not in taken:
+                current[vals[i]] = idx
+                yield from assign(i + 1, current)
+                del current[vals[i]]
+
+    yield from assign(0, {})
+
+
+def _matches(
+    compiled: Callable,
+    ops: tuple,
+    pairs: list[tuple[int, int]],
+    seed_block: list[int],
+) -> bool:
+    for value, expected in pairs:
+        bytecode_input = value >> 7
+        try:
+            result_lo = compiled(bytecode_input, seed_block, ops)
+            if (result_lo ^ expected) & 0xFFFFFFFF:
+                return False
+            result_hi = compiled(~bytecode_input & 0xFFFFFFFF, seed_block, ops)
+        except IndexError:
+            return False
+        if result_hi << 32 | result_lo != expected:
+            return False
+    return True
+
+
+def _resolve(
+    emitter: _SymbolicEmitter,
+    program: list,
+    pairs: list[tuple[int, int]],
+    seed_block: list[int],
+) -> list[Domains]:
+    # Tries every assignment of the values an emitted slot depends on, and
+    # returns the constraints for each one that reproduces the pairs
+    domains = emitter.domains
+    max_cost = emitter.max_cost
+    checks = [
+        (fixed, counts, overflow) for _, fixed, counts, overflow in emitter.checks
+    ]
+    symbols = [entry[1:] for entry in program if entry[0] == "s"]
+    touched = {(group, val) for group, val, _ in symbols}
+    for _, counts, _ in checks:
+        touched.update(counts)
+
+    # Assign the values most cost checks depend on first, so that branches
+    # contradicting a recorded decision get cut early.
+    keys = sorted(touched, key=lambda key: -sum(c[key] for _, c, _ in checks))
+    key_checks = [
+        [(k, counts[key]) for k, (_, counts, _) in enumerate(checks) if key in counts]
+        for key in keys
+    ]
+    remaining_lo = [[0] * len(checks) for _ in range(len(keys) + 1)]
+    remaining_hi = [[0] * len(checks) for _ in range(len(keys) + 1)]
+    for i in range(len(keys) - 1, -1, -1):
+        group, val = keys[i]
+        costs = [_INDEX_COSTS[idx] for idx in domains[group][val]]
+        remaining_lo[i] = list(remaining_lo[i + 1])
+        remaining_hi[i] = list(remaining_hi[i + 1])
+        for k, count in key_checks[i]:
+            remaining_lo[i][k] += count * min(costs)
+            remaining_hi[i][k] += count * max(costs)
+
+    def feasible(k: int, i: int) -> bool:
+        if checks[k][2]:
+            return partial[k] + remaining_hi[i][k] > max_cost
+        return partial[k] + remaining_lo[i][k] <= max_cost
+
+    # Groups where values outside this slot are already constrained need a
+    # check that they can still be completed to a permutation.
+    restricted = [
+        any(
+            (group, val) not in touched and len(domain) < len(domains[group])
+            for val, domain in enumerate(domains[group])
+        )
+        for group in range(3)
+    ]
+
+    compiled = _compile_symbolic(program)
+    symbol_ops = [
+        (keys.index((group, val)), {i: _op_function(*op) for i, (_, op) in o.items()})
+        for group, val, o in symbols
+    ]
+    partial = [fixed for fixed, _, _ in checks]
+    chosen = [0] * len(keys)
+    taken: list[set[int]] = [set(), set(), set()]
+    survivors = []
+
+    def finish() -> None:
+        for group in range(3):
+            if not restricted[group]:
+                continue
+            pinned = list(domains[group])
+            for (g, val), idx in zip(keys, chosen):
+                if g == group:
+                    pinned[val] = frozenset([idx])
+            if not _has_matching(tuple(pinned)):
+                return
+
+        ops = tuple(options[chosen[key]] for key, options in symbol_ops)
+        if _matches(compiled, ops, pairs, seed_block):
+            refined = domains
+            for (group, val), idx in zip(keys, chosen):
+                refined = _refine(refined, group, val, frozenset([idx]))
+            survivors.append(refined)
+
+    def visit(i: int) -> None:
+        if i == len(keys):
+            return finish()
+
+        group, val = keys[i]
+        for idx in sorted(domains[group][val] - taken[group]):
+            cost = _INDEX_COSTS[idx]
+            for k, count in key_checks[i]:
+                partial[k] += count * cost
+            if all(feasible(k, i + 1) for k, _ in key_checks[i]):
+                taken[group].add(idx)
+                chosen[i] = idx
+                visit(i + 1)
+                taken[group].discard(idx)
+            for k, count in key_checks[i]:
+                partial[k] -= count * cost
+
+    if all(feasible(k, 0) for k in range(len(checks))):
+        visit(0)
+    return survivors
+
+
+def _step(
+    state: State,
+    slot: int,
+    pairs: list[tuple[int, int]],
+    rng_variant: RNGVariant,
+    seed_block: list[int],
+) -> tuple[list[State], list[State]]:
+    # Returns refined states to emit the slot again with, and the states that
+    # passed the slot's pairs.
+    domains, decisions = state
+    emitter = _SymbolicEmitter(slot_seed(slot), rng_variant, domains, decisions)
+    try:
+        program = emitter.emit()
+    except _Branch as e:
+        refined = []
+        for part in e.parts:
+            candidate = _refine(domains, e.group, e.val, part)
+            if _has_matching(candidate[e.group]):
+                refined.append((candidate, decisions))
+        return refined, []
+    except _CostBranch as e:
+        return [(domains, decisions | {(e.key, b)}) for b in (False, True)], []
+
+    passed = _resolve(emitter, program, pairs, seed_block)
+    return [], [(d, frozenset()) for d in passed]
+
+
+def _initial_state(known: list[None | int]) -> State:
+    # Entries of the order table that are already known pin their value to
+    # that index.
+    domains = []
+    for group in ORDER_GROUPS:
+        free = frozenset(idx for idx in group if known[idx] is None)
+        values = [free] * len(group)
+        for idx in group:
+            if known[idx] is not None:
+                values[known[idx]] = frozenset([idx])
+        domains.append(tuple(values))
+    return tuple(domains), frozenset()
+
+
+def _search(
+    state: State,
+    depth: int,
+    slots: list[tuple[int, list]],
+    rng_variant: RNGVariant,
+    seed_block: list[int],
+) -> Iterator[Domains]:
+    stack = [(state, depth)]
+    while stack:
+        state, depth = stack.pop()
+        if depth == len(slots):
+            yield state[0]
+            continue
+        slot, pairs = slots[depth]
+        refined, passed = _step(state, slot, pairs, rng_variant, seed_block)
+        stack.extend((s, depth + 1) for s in passed)
+        stack.extend((s, depth) for s in refined)
+
+
+def _search_task(
+    state: State,
+    depth: int,
+    slots: list[tuple[int, list]],
+    rng_variant: RNGVariant,
+    seed_block: list[int],
+) -> list[Domains]:
+    return list(_search(state, depth, slots, rng_variant, seed_block))
+
+
+def complete_orders(domains: Domains) -> Iterator[list[int]]:
+    # Every full order table consistent with a search result
+    choices = [list(_assignments(group, list(range(len(group))))) for group in domains]
+    for combo in itertools.product(*choices):
+        order = [0] * 17
+        for assignment in combo:
+            for val, idx in assignment.items():
+                order[idx] = val
+        yield order
+
+
+def _encode_domains(domains: Domains) -> list:
+    return [[sorted(d) for d in group] for group in domains]
+
+
+def _decode_domains(encoded: list) -> Domains:
+    return tuple(tuple(frozenset(d) for d in group) for group in encoded)
+
+
+class OrderSearch:
+    def __init__(
+        self,
+        pairs: list[tuple[int, int]],
+        rng_variant: RNGVariant,
+        seed_block: None | list[int] = None,
+        known: None | list[None | int] = None,
+    ) -> None:
+        by_slot: dict[int, list[tuple[int, int]]] = {}
+        for value, expected in pairs:
+            by_slot.setdefault(value % 128, []).append((value, expected))
+        self.rng_variant = rng_variant
+        # Short slots depend on few order table entries and branch the least,
+        # so checking them first prunes the search the most.
+        reference = [idx for group in ORDER_GROUPS for idx in range(len(group))]
+        self.slots = sorted(
+            by_slot.items(),
+            key=lambda item: len(
+                BytecodeEmitter(slot_seed(item[0]), reference, rng_variant).emit()
+            ),
+        )
+        self.seed_block = [] if seed_block is None else seed_block
+        self.known = known or [None] * len(ORDER_INSTRUCTIONS)
+
+    def digest(self) -> str:
+        # Identifies the search inputs, so checkpoints of other searches
+        # aren't resumed
+        inputs = {
+            "slots": self.slots,
+            "rng_variant": self.rng_variant.name,
+            "seed_block": self.seed_block,
+            "known": self.known,
+        }
+        return hashlib.sha256(json.dumps(inputs).encode("utf-8")).hexdigest()
+
+    def _frontier(self, min_tasks: int) -> list[tuple[State, int]]:
+        # Breadth-first expansion until there's enough work to spread around
+        frontier = [(_initial_state(self.known), 0)]
+        while len(frontier) < min_tasks:
+            expanded = []
+            for state, depth in frontier:
+                if depth == len(self.slots):
+                    expanded.append((state, depth))
+                    continue
+                slot, pairs = self.slots[depth]
+                refined, passed = _step(
+                    state, slot, pairs, self.rng_variant, self.seed_block
+                )
+                expanded.extend((s, depth + 1) for s in passed)
+                expanded.extend((s, depth) for s in refined)
+            if all(depth == len(self.slots) for _, depth in expanded):
+                return expanded
+            frontier = expanded
+        return frontier
+
+    def run(self) -> list[list[int]]:
+        results = _search(
+            _initial_state(self.known), 0, self.slots, self.rng_variant, self.seed_block
+        )
+        return [order for domains in results for order in complete_orders(domains)]
+
+    def run_parallel(
+        self,
+        workers: None | int = None,
+        checkpoint: None | str = None,
+        progress: None | Callable[[int, int, int], None] = None,
+    ) -> list[list[int]]:
+        workers = workers or os.cpu_count() or 1
+        tasks = self._frontier(workers * 16)
+
+        # Tasks are derived deterministically from the search inputs, so a
+        # checkpoint only has to remember which of them already finished.
+        digest = self.digest()
+        done: dict[int, list[Domains]] = {}
+        if checkpoint is not None and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                state = json.load(f)
+            if state.get("digest") == digest and state.get("tasks") == len(tasks):
+                for i, results in state["done"].items():
+                    done[int(i)] = [_decode_domains(r) for r in results]
+
+        def save_checkpoint() -> None:
+            if checkpoint is None:
+                return
+            state = {
+                "digest": digest,
+                "tasks": len(tasks),
+                "done": {
+                    i: [_encode_domains(r) for r in results]
+                    for i, results in done.items()
+                },
+            }
+            tmp_path = f"{checkpoint}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, checkpoint)
+
+        with ProcessPoolExecutor(workers) as executor:
+            futures = {
+                executor.submit(
+                    _search_task,
+                    state,
+                    depth,
+                    self.slots,
+                    self.rng_variant,
+                    self.seed_block,
+                ): i
+                for i, (state, depth) in enumerate(tasks)
+                if i not in done
+            }
+            for future in as_completed(futures):
+                done[futures[future]] = future.result()
+                save_checkpoint()
+                if progress is not None:
+                    found = sum(len(results) for results in done.values())
+                    progress(len(done), len(tasks), found)
+
+        return [
+            order
+            for i in sorted(done)
+            for domains in done[i]
+            for order in complete_orders(domains)
+        ]
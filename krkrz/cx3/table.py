@@ -3,82 +3,363 @@
 # SPDX-License-Identifier: 0BSD
 
 import struct
-from krkrz.cx3.hashdb import HashType, HashDatabase
+from array import array
+from bisect import bisect_left
+from typing import Callable, Iterator, Sequence
+from krkrz.cx3.hashdb import HashType, HashResolver
+
+
+_U32_BE = struct.Struct(">I")
+_U64_BE = struct.Struct(">Q")
+
+
+class MarshalError(Exception):
+    pass
 
 
 class MarshalReader:
-    def __init__(self, data: bytes) -> None:
+    def __init__(self, data: bytes, zero_copy: bool = False) -> None:
         self.data = data
+        self.view = memoryview(data)
         self.offset = 0
+        # Whether bytes values come back as memoryviews into data
+        self.zero_copy = zero_copy
 
-    def read_value(self) -> bytes | list | int:
+    def read_array_header(self) -> int:
+        # Consumes only the header of an array, returning its length, so its
+        # values can be read one by one
+        if self.offset + 5 > len(self.data):
+            raise MarshalError("Truncated marshal data")
         kind = self.data[self.offset]
-        self.offset += 1
-        if kind == 0x81:  # array
-            (count,) = struct.unpack(">I", self.data[self.offset : self.offset + 4])
-            self.offset += 4
-
-            values = []
-            for _ in range(count):
-                values.append(self.read_value())
-            return values
-        elif kind == 0x03:  # bytes
-            (size,) = struct.unpack(">I", self.data[self.offset : self.offset + 4])
-            self.offset += 4
-
-            data_offset = self.offset
-            self.offset += size
-            return self.data[data_offset : data_offset + size]
-        elif kind == 0x04:  # uint64
-            (value,) = struct.unpack(">Q", self.data[self.offset : self.offset + 8])
-            self.offset += 8
-            return value
-        else:
-            raise Exception(f"Unknown value type: {kind:02x}")
+        if kind != 0x81:
+            raise MarshalError(f"Expected an array, got value type: {kind:02x}")
+        (count,) = _U32_BE.unpack_from(self.data, self.offset + 1)
+        self.offset += 5
+        return count
+
+    def read_value(self) -> bytes | memoryview | list | int:
+        data = self.data
+        view = self.view
+        zero_copy = self.zero_copy
+        unpack_u32 = _U32_BE.unpack_from
+        unpack_u64 = _U64_BE.unpack_from
+        offset = self.offset
+
+        # Arrays still being filled, with how many values each is missing
+        stack: list[list] = []
+        missing: list[int] = []
+        try:
+            while True:
+                kind = data[offset]
+                offset += 1
+                count = 0
+                value: bytes | memoryview | list | int
+                if kind == 0x81:  # array
+                    (count,) = unpack_u32(data, offset)
+                    offset += 4
+                    value = []
+                elif kind == 0x03:  # bytes
+                    (size,) = unpack_u32(data, offset)
+                    offset += 4
+                    if offset + size > len(data):
+                        raise MarshalError("Truncated marshal data")
+                    if zero_copy:
+                        value = view[offset : offset + size]
+                    else:
+                        value = data[offset : offset + size]
+                    offset += size
+                elif kind == 0x04:  # uint64
+                    (value,) = unpack_u64(data, offset)
+                    offset += 8
+                else:
+                    raise MarshalError(f"Unknown value type: {kind:02x}")
+
+                if stack:
+                    stack[-1].append(value)
+                    missing[-1] -= 1
+                else:
+                    root = value
+                if count:
+                    stack.append(value)  # type: ignore # arrays have a count
+                    missing.append(count)
+                while stack and not missing[-1]:
+                    stack.pop()
+                    missing.pop()
+                if not stack:
+                    self.offset = offset
+                    return root
+        except (IndexError, struct.error):
+            raise MarshalError("Truncated marshal data") from None
+
+
+class TableColumns:
+    # Struct-of-arrays storage for the entries of a table: hashes packed
+    # back to back in one buffer each, and ids and keys in arrays, which
+    # NumPy can wrap with frombuffer without copying. The files of path i
+    # are those from path_offsets[i] to path_offsets[i + 1].
+    def __init__(self) -> None:
+        self.path_hash_size = 0
+        self.path_hashes = bytearray()
+        self.path_offsets = array("Q", [0])
+        self.name_hash_size = 0
+        self.name_hashes = bytearray()
+        self.ids = array("Q")
+        self.keys = array("Q")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add_path(self, hash: bytes, children: list) -> int:
+        # Appends a path decoded from the marshalled table, returning its
+        # index
+        self.path_hash_size = _check_hash_size(self.path_hash_size, hash)
+        self.path_hashes += hash
+        for i in range(0, len(children), 2):
+            name_hash, [id, key] = children[i : i + 2]
+            self.name_hash_size = _check_hash_size(self.name_hash_size, name_hash)
+            self.name_hashes += name_hash
+            self.ids.append(id)
+            self.keys.append(key)
+        self.path_offsets.append(len(self.ids))
+        return len(self.path_offsets) - 2
+
+    def path_hash(self, index: int) -> bytes:
+        size = self.path_hash_size
+        return bytes(self.path_hashes[index * size : (index + 1) * size])
+
+    def name_hash(self, index: int) -> bytes:
+        size = self.name_hash_size
+        return bytes(self.name_hashes[index * size : (index + 1) * size])
+
+
+def _check_hash_size(size: int, hash: bytes) -> int:
+    if size and len(hash) != size:
+        raise Exception("Inconsistent hash sizes in archive table")
+    return len(hash)
 
 
 class FileEntry:
-    def __init__(self, value: list) -> None:
-        self.hash = value[0]
-        self.id = value[1][0]
-        self.key = value[1][1]
+    # View of one file in TableColumns
+    __slots__ = ("columns", "index")
+
+    def __init__(self, columns: TableColumns, index: int) -> None:
+        self.columns = columns
+        self.index = index
+
+    @property
+    def hash(self) -> bytes:
+        return self.columns.name_hash(self.index)
 
+    @property
+    def id(self) -> int:
+        return self.columns.ids[self.index]
 
-def dump_hash(hash: tuple[int, bytes], hdb: HashDatabase | None) -> str:
-    resolved_name = None
-    if hdb:
-        resolved_name = hdb.resolve_hash(hash[0], hash[1])
+    @property
+    def key(self) -> int:
+        return self.columns.keys[self.index]
+
+    def __eq__(self, other: object) -> bool:
+        return (
+            isinstance(other, FileEntry)
+            and self.columns is other.columns
+            and self.index == other.index
+        )
+
+    def __hash__(self) -> int:
+        return hash((id(self.columns), self.index))
+
+
+def dump_hash(hash: tuple[int, bytes], names: dict[tuple[int, bytes], str]) -> str:
+    resolved_name = names.get(hash)
     if resolved_name is not None:
         return f"{resolved_name} ({hash[1].hex()})"
     else:
         return hash[1].hex()
 
 
+def resolve_names(
+    paths: list["PathEntry"], hdb: HashResolver | None
+) -> dict[tuple[int, bytes], str]:
+    # Names of the paths and their files, resolved in one batch per kind
+    if hdb is None:
+        return {}
+    names = {}
+    path_hashes = [path.hash for path in paths]
+    for hash, name in hdb.resolve_many(HashType.PATH_SIPHASH_48, path_hashes).items():
+        names[(HashType.PATH_SIPHASH_48, hash)] = name
+    file_hashes = [file.hash for path in paths for file in path.files]
+    for hash, name in hdb.resolve_many(HashType.FILE_BLAKE2S, file_hashes).items():
+        names[(HashType.FILE_BLAKE2S, hash)] = name
+    return names
+
+
 class PathEntry:
-    def __init__(self, value: list) -> None:
-        [hash, children] = value
-        self.hash = hash
-        self.files = [
-            FileEntry(children[i : i + 2]) for i in range(0, len(children), 2)
-        ]
-
-    def dump(self, hdb: HashDatabase | None) -> None:
-        path_hash = dump_hash((HashType.PATH_SIPHASH_48, self.hash), hdb)
+    # View of one path in TableColumns
+    __slots__ = ("columns", "index")
+
+    def __init__(self, columns: TableColumns, index: int) -> None:
+        self.columns = columns
+        self.index = index
+
+    @property
+    def hash(self) -> bytes:
+        return self.columns.path_hash(self.index)
+
+    @property
+    def files(self) -> list[FileEntry]:
+        start = self.columns.path_offsets[self.index]
+        end = self.columns.path_offsets[self.index + 1]
+        return [FileEntry(self.columns, i) for i in range(start, end)]
+
+    def __eq__(self, other: object) -> bool:
+        return (
+            isinstance(other, PathEntry)
+            and self.columns is other.columns
+            and self.index == other.index
+        )
+
+    def __hash__(self) -> int:
+        return hash((id(self.columns), self.index))
+
+    def dump(
+        self,
+        hdb: HashResolver | None,
+        names: None | dict[tuple[int, bytes], str] = None,
+    ) -> None:
+        if names is None:
+            names = resolve_names([self], hdb)
+        path_hash = dump_hash((HashType.PATH_SIPHASH_48, self.hash), names)
         print(f"* Path {path_hash}")
         for file in self.files:
             print(f"\t* File {file.id}")
-            file_hash = dump_hash((HashType.FILE_BLAKE2S, file.hash), hdb)
+            file_hash = dump_hash((HashType.FILE_BLAKE2S, file.hash), names)
             print(f"\t\t- Name hash: {file_hash}")
             print(f"\t\t- Key: {file.key:016x}")
 
 
+class PathList(Sequence):
+    # PathEntry views of every path in TableColumns, made as they're accessed
+    def __init__(self, columns: TableColumns) -> None:
+        self.columns = columns
+
+    def __len__(self) -> int:
+        return len(self.columns.path_offsets) - 1
+
+    def __getitem__(self, index):  # type: ignore # int or slice
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("path index out of range")
+        return PathEntry(self.columns, index)
+
+
+class TableIndex:
+    # Entry indices of TableColumns in binary search order: paths by hash,
+    # the files of each path by name hash, and all files by id. The files of
+    # path i stay between path_offsets[i] and path_offsets[i + 1] in
+    # file_order. These are plain arrays, so TableCache stores them and maps
+    # them back in.
+    def __init__(self, path_order: array, file_order: array, id_order: array) -> None:
+        self.path_order = path_order
+        self.file_order = file_order
+        self.id_order = id_order
+
+    @classmethod
+    def build(cls, columns: TableColumns) -> "TableIndex":
+        offsets = columns.path_offsets
+        path_order = array("Q", sorted(range(len(offsets) - 1), key=columns.path_hash))
+        file_order = array("Q")
+        for path in range(len(offsets) - 1):
+            files = range(offsets[path], offsets[path + 1])
+            file_order.extend(sorted(files, key=columns.name_hash))
+        id_order = array("Q", sorted(range(len(columns)), key=columns.ids.__getitem__))
+        return cls(path_order, file_order, id_order)
+
+
+def _find(
+    order: Sequence[int],
+    target: object,
+    key: Callable[[int], object],
+    start: int = 0,
+    end: None | int = None,
+) -> None | int:
+    # The entry in order[start:end], sorted by key, whose key is target
+    end = len(order) if end is None else end
+    i = bisect_left(order, target, start, end, key=key)
+    if i < end and key(order[i]) == target:
+        return order[i]
+    return None
+
+
 class ArchiveTable:
     def __init__(self, data: bytes) -> None:
-        parsed = MarshalReader(data).read_value()
-        if not isinstance(parsed, list):
-            raise Exception("Expected marshalled table type to be a list")
-        self.paths = [PathEntry(parsed[i : i + 2]) for i in range(0, len(parsed), 2)]
+        self.columns = TableColumns()
+        self.paths: Sequence[PathEntry] = list(
+            ArchiveTable.iter_paths(data, self.columns)
+        )
+        self._index: None | TableIndex = None
+
+    @classmethod
+    def from_columns(
+        cls, columns: TableColumns, index: None | TableIndex = None
+    ) -> "ArchiveTable":
+        # Nothing is done per entry here, so tables mapped in from TableCache
+        # are ready at once
+        table = cls.__new__(cls)
+        table.columns = columns
+        table.paths = PathList(columns)
+        table._index = index
+        return table
+
+    @staticmethod
+    def iter_paths(
+        data: bytes, columns: None | TableColumns = None
+    ) -> Iterator[PathEntry]:
+        # Decodes one path at a time, never holding the whole tree. Paths go
+        # into the given columns, or each into columns of its own.
+        reader = MarshalReader(data)
+        for _ in range(reader.read_array_header() // 2):
+            path_hash = reader.read_value()
+            children = reader.read_value()
+            target = TableColumns() if columns is None else columns
+            index = target.add_path(path_hash, children)  # type: ignore # checked by add_path
+            yield PathEntry(target, index)
+
+    @property
+    def index(self) -> TableIndex:
+        # Built on first use unless it came with the columns
+        if self._index is None:
+            self._index = TableIndex.build(self.columns)
+        return self._index
+
+    def _find_path(self, path_hash: bytes) -> None | int:
+        return _find(self.index.path_order, bytes(path_hash), self.columns.path_hash)
+
+    def lookup(self, path_hash: bytes, name_hash: bytes) -> None | FileEntry:
+        path = self._find_path(path_hash)
+        if path is None:
+            return None
+        columns = self.columns
+        index = _find(
+            self.index.file_order,
+            bytes(name_hash),
+            columns.name_hash,
+            columns.path_offsets[path],
+            columns.path_offsets[path + 1],
+        )
+        return None if index is None else FileEntry(columns, index)
+
+    def by_id(self, id: int) -> None | FileEntry:
+        index = _find(self.index.id_order, id, self.columns.ids.__getitem__)
+        return None if index is None else FileEntry(self.columns, index)
+
+    def files_in(self, path_hash: bytes) -> list[FileEntry]:
+        path = self._find_path(path_hash)
+        return [] if path is None else PathEntry(self.columns, path).files
 
-    def dump(self, hdb: HashDatabase | None) -> None:
+    def dump(self, hdb: HashResolver | None) -> None:
+        names = resolve_names(self.paths, hdb)
         for path in self.paths:
-            path.dump(hdb)
+            path.dump(hdb, names)
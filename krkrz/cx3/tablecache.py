@@ -0,0 +1,200 @@
+# SPDX-FileCopyrightText: 2024 yanchan09 <yan@omg.lol>
+#
+# SPDX-License-Identifier: 0BSD
+
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import time
+from krkrz.cx3.table import ArchiveTable, TableColumns, TableIndex
+
+# Magic, version, byte order, path hash size, name hash size, path count,
+# file count, then the archive size, mtime and Hxv4 offset the table was
+# decoded from, and the length of the archive path that follows
+_HEADER = struct.Struct("<4sIBxxxIIQQQqQQ")
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+class TableCache:
+    # Decoded archive tables, stored as their columns and lookup index so
+    # that they can be mapped back in and searched without decrypting or
+    # decoding anything
+    VERSION = 2
+    MAGIC = b"KRTC"
+
+    def __init__(
+        self,
+        directory: str,
+        max_age: None | float = None,
+        max_bytes: None | int = None,
+    ) -> None:
+        self.directory = directory
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def default_directory() -> str:
+        cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+        return os.path.join(cache_dir, "krkrz-tools", "tables")
+
+    @classmethod
+    def open_default(
+        cls, max_age: None | float = None, max_bytes: None | int = 1 << 30
+    ) -> "TableCache":
+        return cls(cls.default_directory(), max_age, max_bytes)
+
+    def _path(self, archive_path: str, hxv4_offset: int) -> str:
+        h = hashlib.sha256(os.path.abspath(archive_path).encode("utf-8"))
+        h.update(struct.pack("<Q", hxv4_offset))
+        return os.path.join(self.directory, f"{h.hexdigest()[:32]}.tbl")
+
+    def _key(self, archive_path: str, hxv4_offset: int) -> tuple[int, int, int, bytes]:
+        stat = os.stat(archive_path)
+        path = os.path.abspath(archive_path).encode("utf-8")
+        return stat.st_size, stat.st_mtime_ns, hxv4_offset, path
+
+    def load(self, archive_path: str, hxv4_offset: int) -> None | ArchiveTable:
+        # Returns None if there's no cached table or it's outdated
+        cache_path = self._path(archive_path, hxv4_offset)
+        try:
+            with open(cache_path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):  # missing or empty file
+            return None
+        if len(data) < _HEADER.size:
+            return None
+
+        (
+            magic,
+            version,
+            little_endian,
+            path_hash_size,
+            name_hash_size,
+            path_count,
+            file_count,
+            size,
+            mtime,
+            offset,
+            path_length,
+        ) = _HEADER.unpack_from(data)
+        if (
+            magic != self.MAGIC
+            or version != self.VERSION
+            or little_endian != (sys.byteorder == "little")
+        ):
+            return None
+        path = bytes(data[_HEADER.size : _HEADER.size + path_length])
+        if (size, mtime, offset, path) != self._key(archive_path, hxv4_offset):
+            return None
+
+        position = _align(_HEADER.size + path_length)
+        sections = []
+        for length in [
+            (path_count + 1) * 8,
+            file_count * 8,
+            file_count * 8,
+            path_count * path_hash_size,
+            file_count * name_hash_size,
+            path_count * 8,
+            file_count * 8,
+            file_count * 8,
+        ]:
+            sections.append(memoryview(data)[position : position + length])
+            position = _align(position + length)
+        if position > len(data):  # truncated
+            return None
+
+        # The modification time doubles as the last use, for evict
+        os.utime(cache_path)
+
+        # Read-only views into the mapping stand in for the arrays
+        columns = TableColumns()
+        columns.path_hash_size = path_hash_size
+        columns.name_hash_size = name_hash_size
+        columns.path_offsets = sections[0].cast("Q")  # type: ignore
+        columns.ids = sections[1].cast("Q")  # type: ignore
+        columns.keys = sections[2].cast("Q")  # type: ignore
+        columns.path_hashes = sections[3]  # type: ignore
+        columns.name_hashes = sections[4]  # type: ignore
+        index = TableIndex(
+            sections[5].cast("Q"),  # type: ignore
+            sections[6].cast("Q"),  # type: ignore
+            sections[7].cast("Q"),  # type: ignore
+        )
+        return ArchiveTable.from_columns(columns, index)
+
+    def save(self, archive_path: str, hxv4_offset: int, table: ArchiveTable) -> None:
+        columns = table.columns
+        index = table.index
+        size, mtime, offset, path = self._key(archive_path, hxv4_offset)
+        header = _HEADER.pack(
+            self.MAGIC,
+            self.VERSION,
+            sys.byteorder == "little",
+            columns.path_hash_size,
+            columns.name_hash_size,
+            len(table.paths),
+            len(columns),
+            size,
+            mtime,
+            offset,
+            len(path),
+        )
+        sections = [
+            header + path,
+            bytes(columns.path_offsets),
+            bytes(columns.ids),
+            bytes(columns.keys),
+            bytes(columns.path_hashes),
+            bytes(columns.name_hashes),
+            bytes(index.path_order),
+            bytes(index.file_order),
+            bytes(index.id_order),
+        ]
+
+        os.makedirs(self.directory, exist_ok=True)
+        cache_path = self._path(archive_path, hxv4_offset)
+        tmp_path = f"{cache_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            for section in sections:
+                f.write(section)
+                f.write(b"\x00" * (_align(len(section)) - len(section)))
+        os.replace(tmp_path, cache_path)
+        self.evict()
+
+    def evict(self) -> None:
+        # Drops tables unused for longer than max_age, then the least recently
+        # used ones until the rest fit in max_bytes
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        entries = []
+        for name in names:
+            if not name.endswith(".tbl"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort(reverse=True)
+
+        now = time.time()
+        total = 0
+        for mtime, size, path in entries:
+            total += size
+            expired = self.max_age is not None and now - mtime > self.max_age
+            too_large = self.max_bytes is not None and total > self.max_bytes
+            if expired or too_large:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
@@ -4,52 +4,457 @@
 
 import struct
 import io
+import mmap
+import threading
+import time
+from array import array
+from concurrent.futures import Future, ThreadPoolExecutor
 from enum import IntFlag
+from typing import Callable, Iterator
 import zlib
 import os
 
+MAGIC = b"XP3\r\n \n\x1a\x8b\x67\x01"
+
+_OFFSET = struct.Struct("<q")
+_COMPRESSED_SIZES = struct.Struct("<qq")
+_CHUNK_HEADER = struct.Struct("<4sq")
+# Flags, original size, packed size and name length of an info subchunk
+_INFO = struct.Struct("<IQQH")
+# Flags, offset, original size and packed size of a segment
+_SEGMENT = struct.Struct("<IQQQ")
+_ADLER32 = struct.Struct("<I")
+# Bytes read from the archive at once while extracting
+_READ_SIZE = 1 << 20
+
 
 class IndexFlag(IntFlag):
     COMPRESSED_ZLIB = 1
     CONTINUE = 0x80
 
 
+class FileFlag(IntFlag):
+    PROTECTED = 1 << 31
+
+
+class SegmentFlag(IntFlag):
+    COMPRESSED_ZLIB = 1
+
+
 def is_xp3_archive(file: io.BufferedIOBase) -> bool:
     magic = file.read(11)
     file.seek(-11, os.SEEK_CUR)
-    return magic == b"XP3\r\n \n\x1a\x8b\x67\x01"
+    return magic == MAGIC
+
+
+def _subchunks(data: memoryview) -> Iterator[tuple[bytes, memoryview]]:
+    offset = 0
+    while offset < len(data):
+        ty, sz = _CHUNK_HEADER.unpack_from(data, offset)
+        offset += _CHUNK_HEADER.size
+        yield ty, data[offset : offset + sz]
+        offset += sz
+
+
+class EntryTable:
+    # File entries of an archive as parallel arrays. The segments of entry i
+    # are segment_starts[i] up to segment_starts[i + 1].
+    def __init__(self) -> None:
+        self.names: list[str] = []
+        self.flags = array("I")
+        self.sizes = array("Q")
+        self.packed_sizes = array("Q")
+        # has_adler32s[i] is 0 if the entry has no adlr subchunk, in which
+        # case adler32s[i] is unused
+        self.adler32s = array("I")
+        self.has_adler32s = array("B")
+        self.segment_starts = array("Q", [0])
+        self.segment_flags = array("I")
+        self.segment_offsets = array("Q")
+        self.segment_sizes = array("Q")
+        self.segment_packed_sizes = array("Q")
+        self.by_name: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def add(self, chunk: memoryview) -> int:
+        # Parses a File chunk and returns the index of its entry
+        info = None
+        segments = None
+        adler32 = None
+        for ty, data in _subchunks(chunk):
+            if ty == b"info":
+                info = data
+            elif ty == b"segm":
+                segments = data
+            elif ty == b"adlr":
+                (adler32,) = _ADLER32.unpack_from(data)
+        if info is None or segments is None:
+            raise Exception("File chunk lacks info or segm subchunk")
+
+        flags, size, packed_size, name_length = _INFO.unpack_from(info)
+        name_end = _INFO.size + name_length * 2
+        name = bytes(info[_INFO.size : name_end]).decode("utf-16-le")
+        index = len(self.names)
+        self.names.append(name)
+        self.flags.append(flags)
+        self.sizes.append(size)
+        self.packed_sizes.append(packed_size)
+        self.adler32s.append(adler32 or 0)
+        self.has_adler32s.append(adler32 is not None)
+        for segment in _SEGMENT.iter_unpack(segments):
+            self.segment_flags.append(segment[0])
+            self.segment_offsets.append(segment[1])
+            self.segment_sizes.append(segment[2])
+            self.segment_packed_sizes.append(segment[3])
+        self.segment_starts.append(len(self.segment_flags))
+        self.by_name[name] = index
+        return index
+
+
+class XP3Entry:
+    # View of one file in an EntryTable
+    __slots__ = ("index", "table")
+
+    def __init__(self, table: EntryTable, index: int) -> None:
+        self.table = table
+        self.index = index
+
+    @property
+    def name(self) -> str:
+        return self.table.names[self.index]
+
+    @property
+    def flags(self) -> FileFlag:
+        return FileFlag(self.table.flags[self.index])
+
+    @property
+    def size(self) -> int:
+        return self.table.sizes[self.index]
+
+    @property
+    def packed_size(self) -> int:
+        return self.table.packed_sizes[self.index]
+
+    @property
+    def adler32(self) -> None | int:
+        if not self.table.has_adler32s[self.index]:
+            return None
+        return self.table.adler32s[self.index]
+
+    @property
+    def segments(self) -> list[tuple[SegmentFlag, int, int, int]]:
+        # Flags, offset, original size and packed size of every segment
+        table = self.table
+        return [
+            (
+                SegmentFlag(table.segment_flags[i]),
+                table.segment_offsets[i],
+                table.segment_sizes[i],
+                table.segment_packed_sizes[i],
+            )
+            for i in range(
+                table.segment_starts[self.index], table.segment_starts[self.index + 1]
+            )
+        ]
+
+    def __eq__(self, other: object) -> bool:
+        return (
+            isinstance(other, XP3Entry)
+            and self.table is other.table
+            and self.index == other.index
+        )
+
+    def __hash__(self) -> int:
+        return hash((id(self.table), self.index))
+
+
+class ExtractStats:
+    def __init__(self, total_files: int, total_bytes: int) -> None:
+        self.started = time.monotonic()
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.files = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def rate(self) -> float:
+        # Bytes written per second
+        elapsed = time.monotonic() - self.started
+        return self.bytes_written / elapsed if elapsed > 0 else 0.0
+
+
+def _output_path(dest: str, name: str) -> str:
+    # Keeps entries from escaping dest
+    relative = os.path.normpath(name.replace("\\", "/")).lstrip("/")
+    if not relative or relative == "." or relative.split(os.sep)[0] == "..":
+        raise Exception(f"Invalid entry name {name!r}")
+    return os.path.join(dest, relative)
+
+
+def _reader(file: io.RawIOBase) -> Callable[[int, int], bytes]:
+    # Reads size bytes at offset from any thread. Without pread (Windows),
+    # the threads share the file position, so seeking and reading are locked.
+    if hasattr(os, "pread"):
+        fd = file.fileno()
+        return lambda size, offset: os.pread(fd, size, offset)
+
+    lock = threading.Lock()
+
+    def read(size: int, offset: int) -> bytes:
+        with lock:
+            file.seek(offset)
+            return file.read(size)
+
+    return read
+
+
+def _extract_entry(
+    read_at: Callable[[int, int], bytes],
+    path: str,
+    segments: list[tuple[SegmentFlag, int, int, int]],
+    adler32: None | int,
+) -> tuple[int, int]:
+    # Copies the segments of an entry to path, inflating compressed ones, and
+    # returns the bytes read and written. Reads, zlib and write all release
+    # the GIL, so entries extract in parallel.
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    checksum = 1
+    read = written = 0
+    with open(path, "wb") as out:
+        for flags, offset, size, packed_size in segments:
+            compressed = SegmentFlag.COMPRESSED_ZLIB in flags
+            decompressor = zlib.decompressobj() if compressed else None
+            end = offset + (packed_size if compressed else size)
+            segment_written = 0
+            while offset < end:
+                data = read_at(min(_READ_SIZE, end - offset), offset)
+                if not data:
+                    raise Exception(f"Truncated segment in {path}")
+                offset += len(data)
+                read += len(data)
+                if decompressor is not None:
+                    data = decompressor.decompress(data)
+                checksum = zlib.adler32(data, checksum)
+                segment_written += out.write(data)
+            if decompressor is not None:
+                data = decompressor.flush()
+                checksum = zlib.adler32(data, checksum)
+                segment_written += out.write(data)
+            if segment_written != size:
+                raise Exception(f"Segment size mismatch in {path}")
+            written += segment_written
+    if adler32 is not None and checksum != adler32:
+        raise Exception(f"Adler-32 mismatch in {path}")
+    return read, written
 
 
 class XP3Archive:
     def __init__(self, file: io.BufferedIOBase) -> None:
-        self.index_chunks: list[tuple[int, bytes]] = []
+        # Reads the whole index from file
+        self._init_index()
+        name = getattr(file, "name", None)
+        if isinstance(name, str):
+            self.path = name
 
         magic = file.read(11)
-        if magic != b"XP3\r\n \n\x1a\x8b\x67\x01":
+        if magic != MAGIC:
             raise Exception("Invalid XP3 archive magic")
 
         index_flags = IndexFlag(0x80)
         while IndexFlag.CONTINUE in index_flags:
-            (index_offset,) = struct.unpack("<q", file.read(8))
+            (index_offset,) = _OFFSET.unpack(file.read(8))
             file.seek(index_offset)
 
             index_flags = IndexFlag(file.read(1)[0])
             if IndexFlag.COMPRESSED_ZLIB in index_flags:
-                compressed_size, real_size = struct.unpack("<qq", file.read(16))
-                index_data = zlib.decompress(file.read(compressed_size))
-                self._add_index_data(index_data)
+                compressed_size, real_size = _COMPRESSED_SIZES.unpack(file.read(16))
+                self.index_blocks.append((index_flags, file.read(compressed_size)))
             else:
-                (real_size,) = struct.unpack("<q", file.read(8))
-                index_data = file.read(real_size)
-                self._add_index_data(index_data)
+                (real_size,) = _OFFSET.unpack(file.read(8))
+                self.index_blocks.append((index_flags, file.read(real_size)))
+        self._index_chunks = list(self.iter_chunks())
 
-    def _add_index_data(self, data: bytes) -> None:
-        offset = 0
-        while offset < len(data):
-            (
-                ty,
-                sz,
-            ) = struct.unpack("<4sq", data[offset : offset + 12])
-            offset += 12
-            self.index_chunks.append((ty, data[offset : offset + sz]))
-            offset += sz
+    def _init_index(self) -> None:
+        # Archive file, needed for extracting
+        self.path: None | str = None
+        self.mapping: None | mmap.mmap = None
+        # Flags and stored data of every index block, decompressed into
+        # self.index_data when first needed
+        self.index_blocks: list[tuple[IndexFlag, bytes | memoryview]] = []
+        self.index_data: dict[int, memoryview] = {}
+        self._index_chunks: None | list[tuple[bytes, memoryview]] = None
+        self._chunks_by_type: None | dict[bytes, list[memoryview]] = None
+        self._entries: None | EntryTable = None
+
+    @classmethod
+    def open(cls, path: str, use_mmap: bool = True) -> "XP3Archive":
+        # With use_mmap, only the chain of index block headers is read up front
+        with open(path, "rb") as f:
+            if not use_mmap:
+                return cls(f)
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            archive = cls.from_buffer(mapping)
+        archive.path = path
+        return archive
+
+    @classmethod
+    def from_buffer(cls, data: bytes | mmap.mmap) -> "XP3Archive":
+        archive = cls.__new__(cls)
+        archive._init_index()
+        if isinstance(data, mmap.mmap):
+            archive.mapping = data
+        view = memoryview(data)
+        if view[:11] != MAGIC:
+            raise Exception("Invalid XP3 archive magic")
+
+        position = 11
+        index_flags = IndexFlag(0x80)
+        while IndexFlag.CONTINUE in index_flags:
+            (position,) = _OFFSET.unpack_from(view, position)
+            if not 0 <= position < len(view):
+                raise Exception("XP3 index offset out of range")
+            index_flags = IndexFlag(view[position])
+            position += 1
+            if IndexFlag.COMPRESSED_ZLIB in index_flags:
+                size, _ = _COMPRESSED_SIZES.unpack_from(view, position)
+                position += 16
+            else:
+                (size,) = _OFFSET.unpack_from(view, position)
+                position += 8
+            if position + size > len(view):
+                raise Exception("Truncated XP3 index")
+            archive.index_blocks.append((index_flags, view[position : position + size]))
+            position += size
+        return archive
+
+    def close(self) -> None:
+        # Releases the views into the mapping before unmapping it, so chunks
+        # handed out can't be used afterwards. Views derived from them still
+        # hold the mapping, and closing raises BufferError.
+        views = [data for _, data in self.index_blocks]
+        views += self.index_data.values()
+        views += (data for _, data in self._index_chunks or ())
+        for data in views:
+            if isinstance(data, memoryview):
+                data.release()
+        self.index_blocks.clear()
+        self.index_data.clear()
+        self._index_chunks = None
+        self._chunks_by_type = None
+        self._entries = None
+        if self.mapping is not None:
+            self.mapping.close()
+            self.mapping = None
+
+    def __enter__(self) -> "XP3Archive":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def _block_data(self, i: int) -> memoryview:
+        data = self.index_data.get(i)
+        if data is None:
+            index_flags, stored = self.index_blocks[i]
+            if IndexFlag.COMPRESSED_ZLIB in index_flags:
+                data = memoryview(zlib.decompress(stored))
+            else:
+                data = memoryview(stored)
+            self.index_data[i] = data
+        return data
+
+    def iter_chunks(self) -> Iterator[tuple[bytes, memoryview]]:
+        # Index chunks in order, decompressing blocks only as they're reached
+        for i in range(len(self.index_blocks)):
+            yield from _subchunks(self._block_data(i))
+
+    @property
+    def index_chunks(self) -> list[tuple[bytes, memoryview]]:
+        if self._index_chunks is None:
+            self._index_chunks = list(self.iter_chunks())
+        return self._index_chunks
+
+    @property
+    def chunks_by_type(self) -> dict[bytes, list[memoryview]]:
+        if self._chunks_by_type is None:
+            self._chunks_by_type = {}
+            for ty, data in self.index_chunks:
+                self._chunks_by_type.setdefault(ty, []).append(data)
+        return self._chunks_by_type
+
+    def get_chunk(self, ty: bytes) -> None | memoryview:
+        # The last index chunk of a type. Index blocks are chained, so later
+        # chunks supersede earlier ones.
+        chunks = self.chunks_by_type.get(ty)
+        return chunks[-1] if chunks else None
+
+    @property
+    def entries(self) -> EntryTable:
+        if self._entries is None:
+            self._entries = EntryTable()
+            for chunk in self.chunks_by_type.get(b"File", []):
+                self._entries.add(chunk)
+        return self._entries
+
+    def entry(self, name: str) -> None | XP3Entry:
+        index = self.entries.by_name.get(name)
+        return None if index is None else XP3Entry(self.entries, index)
+
+    def iter_entries(self) -> Iterator[XP3Entry]:
+        entries = self.entries
+        for i in range(len(entries)):
+            yield XP3Entry(entries, i)
+
+    def extract_all(
+        self,
+        dest: str,
+        workers: None | int = None,
+        progress: None | Callable[[ExtractStats], None] = None,
+    ) -> ExtractStats:
+        # Writes every entry below dest. Entries are handed to the thread
+        # pool in order of their first segment, so the archive is read front
+        # to back.
+        if self.path is None:
+            raise Exception("Archive wasn't opened from a path")
+        entries = sorted(
+            self.iter_entries(),
+            key=lambda entry: min((s[1] for s in entry.segments), default=0),
+        )
+        paths = [_output_path(dest, entry.name) for entry in entries]
+        # Names differing only in case would be written to the same file on
+        # case-insensitive filesystems, possibly from two threads at once
+        seen: set[str] = set()
+        for entry, path in zip(entries, paths):
+            key = path.lower()
+            if key in seen:
+                raise Exception(f"Duplicate entry name {entry.name!r}")
+            seen.add(key)
+        stats = ExtractStats(len(entries), sum(entry.size for entry in entries))
+        workers = workers or os.cpu_count() or 1
+
+        def collect(future: Future) -> None:
+            read, written = future.result()
+            stats.files += 1
+            stats.bytes_read += read
+            stats.bytes_written += written
+            if progress is not None:
+                progress(stats)
+
+        with open(self.path, "rb", buffering=0) as file:
+            read_at = _reader(file)
+            with ThreadPoolExecutor(workers) as executor:
+                # Bounded, so a failure stops the extraction early
+                in_flight: list[Future] = []
+                for entry, path in zip(entries, paths):
+                    in_flight.append(
+                        executor.submit(
+                            _extract_entry, read_at, path, entry.segments, entry.adler32
+                        )
+                    )
+                    if len(in_flight) >= workers * 4:
+                        collect(in_flight.pop(0))
+                for future in in_flight:
+                    collect(future)
+        return stats
@@ -2,7 +2,26 @@
 #
 # SPDX-License-Identifier: 0BSD
 
-from krkrz.cx3.bytecode import BytecodeInterpreter, Instruction
+import json
+import pytest
+from krkrz._rng import SplitMix64
+from krkrz.cx3.bytecode import (
+    Blackbox,
+    BytecodeEmitter,
+    BytecodeInterpreter,
+    ExecutionMode,
+    Instruction,
+    RNGVariant,
+    compile_bytecode,
+    optimize_bytecode,
+)
+
+ORDER = [3, 1, 4, 0, 7, 5, 2, 6, 2, 0, 5, 1, 4, 3, 1, 2, 0]
+
+
+def _seed_block() -> list[int]:
+    rng = SplitMix64(0x1234)
+    return [rng.next() & 0xFFFFFFFF for _ in range(1024)]
 
 
 def test_arithmetic():
@@ -94,3 +113,176 @@ def test_subroutines():
         ]
     )
     assert value == 3780
+
+
+def test_compiled_subroutines():
+    interp = BytecodeInterpreter(42)
+    program = [
+        (Instruction.LOAD_ARG, 5),
+        (Instruction.SAVE_TO_CONTEXT, 0),
+        (Instruction.SUBROUTINE, 0),
+        (Instruction.LOAD_INPUT, 0),
+        (Instruction.SAVE_TO_CONTEXT, 0),
+        (Instruction.SHL_CONTEXT, 0),
+        (Instruction.RETURN, 0),
+        (Instruction.SUBTRACT_FROM_CONTEXT, 0),
+        (Instruction.RETURN, 0),
+        (Instruction.LOAD_ARG, 0x55555555),
+    ]
+    assert compile_bytecode(program)(42) == interp.exec(program)
+
+
+def test_compiled_matches_interpreter():
+    seed_block = _seed_block()
+    blackbox = Blackbox(ORDER, RNGVariant.PLUS)
+    rng = SplitMix64(0x5678)
+    for idx in range(128):
+        slot = blackbox._ensure_slot(idx)
+        compiled = compile_bytecode(slot)
+        for _ in range(8):
+            value = rng.next() & 0xFFFFFFFF
+            expected = BytecodeInterpreter(value, seed_block).exec(slot)
+            assert compiled(value, seed_block) == expected
+
+
+def test_blackbox_modes():
+    seed_block = _seed_block()
+    for variant in RNGVariant:
+        interpreted = Blackbox(
+            ORDER, variant, ExecutionMode.INTERPRETER, seed_block, optimize=False
+        )
+        compiled = Blackbox(ORDER, variant, ExecutionMode.COMPILED, seed_block)
+        rng = SplitMix64(0x9ABC)
+        for _ in range(512):
+            value = rng.next()
+            assert compiled.execute(value) == interpreted.execute(value)
+
+
+def test_execute_many():
+    np = pytest.importorskip("numpy")
+    blackbox = Blackbox(ORDER, RNGVariant.STAR, seed_block=_seed_block())
+    rng = SplitMix64(0xDEF0)
+    values = [rng.next() for _ in range(2048)] + [0, 127, 128, 2**64 - 1]
+    expected = np.array([blackbox.execute(v) for v in values], dtype=np.uint64)
+    result = blackbox.execute_many(np.array(values, dtype=np.uint64))
+    assert result.dtype == np.uint64
+    assert (result == expected).all()
+    assert (blackbox.execute_many(v for v in values) == expected).all()
+
+
+def test_slot_cache(tmp_path):
+    path = str(tmp_path / "slots.json")
+    warmed = Blackbox(ORDER, RNGVariant.PLUS, cache_path=path)
+    warmed.warm()
+
+    cached = Blackbox(ORDER, RNGVariant.PLUS, cache_path=path)
+    assert cached.load(path)
+    assert cached.slots == warmed.slots
+
+    lazy = Blackbox(ORDER, RNGVariant.PLUS, cache_path=path)
+    lazy._ensure_slot(3)
+    assert lazy.slots == warmed.slots
+
+    assert not Blackbox(ORDER, RNGVariant.STAR).load(path)
+    assert not Blackbox(list(reversed(ORDER)), RNGVariant.PLUS).load(path)
+    assert not Blackbox(ORDER, RNGVariant.PLUS).load(str(tmp_path / "missing.json"))
+
+
+def test_slot_cache_malformed(tmp_path):
+    path = tmp_path / "slots.json"
+    blackbox = Blackbox(ORDER, RNGVariant.PLUS)
+    header = blackbox._cache_header()
+    for cached in [
+        [],
+        {"header": header},
+        {"header": header, "slots": [[["NOT_AN_INSTRUCTION", 0]]] * 128},
+    ]:
+        path.write_text(json.dumps(cached))
+        assert not blackbox.load(str(path))
+
+    # Emitting every slot lazily still gets the cache written by warm
+    lazy = Blackbox(ORDER, RNGVariant.PLUS, cache_path=str(path))
+    for idx in range(128):
+        lazy._ensure_slot(idx)
+    lazy.warm()
+    assert Blackbox(ORDER, RNGVariant.PLUS).load(str(path))
+
+
+def test_slot_cache_version(tmp_path, monkeypatch):
+    path = str(tmp_path / "slots.json")
+    Blackbox(ORDER, RNGVariant.PLUS, cache_path=path).warm()
+    monkeypatch.setattr(BytecodeEmitter, "VERSION", BytecodeEmitter.VERSION + 1)
+    assert not Blackbox(ORDER, RNGVariant.PLUS).load(path)
+
+
+def test_optimizer_folds_constants():
+    program = [
+        (Instruction.SUBROUTINE, 0),
+        (Instruction.LOAD_ARG, 3),
+        (Instruction.SAVE_TO_CONTEXT, 0),
+        (Instruction.SUBROUTINE, 0),
+        (Instruction.LOAD_ARG, 5),
+        (Instruction.SAVE_TO_CONTEXT, 0),
+        (Instruction.LOAD_ARG, 7),
+        (Instruction.MULTIPLY_CONTEXT, 0),
+        (Instruction.RETURN, 0),
+        (Instruction.BITWISE_XOR, 0x10),
+        (Instruction.SUBTRACT_CONTEXT, 0),
+        (Instruction.RETURN, 0),
+        (Instruction.RETURN, 0),
+    ]
+    assert optimize_bytecode(program) == [
+        (Instruction.LOAD_ARG, (35 ^ 0x10) - 3),
+        (Instruction.RETURN, 0),
+    ]
+
+
+def test_optimizer_merges_arithmetic():
+    program = [
+        (Instruction.SUBROUTINE, 0),
+        (Instruction.LOAD_ARG, 10),
+        (Instruction.SAVE_TO_CONTEXT, 0),
+        (Instruction.LOAD_INPUT, 0),
+        (Instruction.ADD_ONE, 0),
+        (Instruction.SUBTRACT_ARG, 4),
+        (Instruction.BITWISE_XOR, 0xF0),
+        (Instruction.BITWISE_XOR, 0x0F),
+        (Instruction.ADD_CONTEXT, 0),
+        (Instruction.RETURN, 0),
+        (Instruction.RETURN, 0),
+    ]
+    assert optimize_bytecode(program) == [
+        (Instruction.LOAD_INPUT, 0),
+        (Instruction.ADD_ARG, 0xFFFFFFFD),
+        (Instruction.BITWISE_XOR, 0xFF),
+        (Instruction.ADD_ARG, 10),
+        (Instruction.RETURN, 0),
+    ]
+
+
+def test_optimizer_matches_original():
+    seed_block = _seed_block()
+    rng = SplitMix64(0x2468)
+    for variant in RNGVariant:
+        blackbox = Blackbox(ORDER, variant, seed_block=seed_block)
+        assert sum(blackbox.optimization_report()) > 0
+        for idx in range(128):
+            slot = blackbox.slots[idx]
+            optimized = blackbox.optimized_slots[idx]
+            for _ in range(16):
+                value = rng.next() >> 7
+                for input in (value, ~value & 0xFFFFFFFF):
+                    expected = BytecodeInterpreter(input, seed_block).exec(slot)
+                    actual = BytecodeInterpreter(input, seed_block).exec(optimized)
+                    assert actual == expected
+
+
+def test_optimizer_keeps_unstructured_bytecode():
+    program = [
+        (Instruction.LOAD_ARG, 5),
+        (Instruction.SAVE_TO_CONTEXT, 0),
+        (Instruction.LOAD_INPUT, 0),
+        (Instruction.MULTIPLY_CONTEXT, 0),
+        (Instruction.RETURN, 0),
+    ]
+    assert optimize_bytecode(program) == program
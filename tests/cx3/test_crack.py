@@ -0,0 +1,74 @@
+# SPDX-FileCopyrightText: 2024 yanchan09 <yan@omg.lol>
+#
+# SPDX-License-Identifier: 0BSD
+
+from krkrz.cx3.crack import crack, expand_patterns, file_hash, path_hash
+from krkrz.cx3.crypt import siphash
+from krkrz.cx3.hashdb import HashDatabase, HashType
+from krkrz.cx3.table import ArchiveTable, TableColumns
+
+PATH_KEY = bytes(range(16))
+FILE_KEY = bytes(range(32))
+
+
+# Outputs of the reference implementation built with cROUNDS=4 and
+# dROUNDS=8, for the usual test key and messages 00, 00 01, ...
+SIPHASH_48_VECTORS = [
+    0xC879052B9938DA41,
+    0xC85914F95295B851,
+    0x33C3DDBEF0163792,
+    0x05C147657DD4466A,
+    0x48FAC14A2B5938C2,
+    0xE14752CFD9D7C2F6,
+    0x8E5535C834BCB66B,
+    0x4EFDBE5A713FD747,
+    0x50DB2F079C8BB520,
+    0x5312E15EF39A3136,
+    0x8F848D0ADBD0A948,
+    0x810A0436603969CC,
+    0x6197A77A53686D4B,
+    0x6950C9F2E9963729,
+    0x689A62A7EA1B4388,
+    0x83D389D57DA9A6E0,
+]
+
+
+def test_siphash():
+    for length, expected in enumerate(SIPHASH_48_VECTORS):
+        assert siphash(PATH_KEY, bytes(range(length))) == expected
+    # SipHash-2-4 reference vectors
+    assert siphash(PATH_KEY, b"", 2, 4) == 0x726FDB47DD0E0E31
+    assert siphash(PATH_KEY, bytes(range(15)), 2, 4) == 0xA129CA6149BE45E5
+    assert path_hash("a", PATH_KEY) == siphash(PATH_KEY, b"a\x00").to_bytes(8, "little")
+
+
+def test_crack(tmp_path):
+    columns = TableColumns()
+    columns.add_path(
+        path_hash("system/", PATH_KEY),
+        [file_hash("main.tjs", FILE_KEY), [0, 0], b"\x00" * 32, [1, 0]],
+    )
+    columns.add_path(b"\x00" * 8, [file_hash("title.tjs", FILE_KEY), [2, 0]])
+    table = ArchiveTable.from_columns(columns)
+    hdb = HashDatabase(str(tmp_path / "hashes.db"))
+
+    candidates = expand_patterns(["(system|data)/", "(main|title|other)\\.tjs"])
+    reports = []
+    stats = crack(
+        candidates,
+        table,
+        PATH_KEY,
+        FILE_KEY,
+        hdb,
+        workers=2,
+        batch_size=2,
+        progress=lambda stats: reports.append(stats.candidates),
+    )
+    assert stats.candidates == 5
+    assert (stats.matches, stats.inserted) == (3, 3)
+    assert reports[-1] == 5
+
+    assert hdb.resolve_hash(HashType.PATH_SIPHASH_48, table.paths[0].hash) == "system/"
+    assert hdb.resolve_many(
+        HashType.FILE_BLAKE2S, [f.hash for f in table.paths[1].files]
+    ) == {file_hash("title.tjs", FILE_KEY): "title.tjs"}
@@ -2,7 +2,7 @@
 #
 # SPDX-License-Identifier: 0BSD
 
-from krkrz.cx3.crypt import KeyDerivator
+from krkrz.cx3.crypt import FnvBlake, KeyDerivator, derive_many, fnv_blake
 
 
 def test_keyderivator():
@@ -23,3 +23,36 @@ def test_keyderivator():
     assert keys.nonce_b == bytes.fromhex(
         "98d9fc0c47eb2684aad17ca33ee8cb1aed30812ee8990500"
     )
+
+
+def test_fnv_blake():
+    data = bytes(range(256)) * 3 + b"xyz"
+    assert fnv_blake(data, 7) == bytes.fromhex(
+        "3a0a4b61214b8f331767462674010ecd1f69b61d9a9e1575fcd38c3da6877772"
+    )
+
+    hasher = FnvBlake(7)
+    for i in range(0, len(data), 13):
+        hasher.update(data[i : i + 13])
+    assert hasher.digest() == fnv_blake(data, 7)
+
+
+def test_derive_many():
+    derivators = [
+        KeyDerivator(
+            bootstrap_string=f"BOOTSTRAP{game}",
+            warning_string="WARNING",
+            params_blob=bytes([game]) * 100,
+            archive_unique_key=f"Archive{archive}",
+            upper_key_seed=b"\x00\x11\x22\x33\x44\x55\x66\x77",
+        )
+        for game in range(2)
+        for archive in range(3)
+    ]
+    results = list(derive_many(derivators, threads=2, processes=2))
+    assert [derivator for derivator, _ in results] == derivators
+    for derivator, keys in results:
+        expected = derivator.derive()
+        assert keys.key == expected.key
+        assert keys.nonce_a == expected.nonce_a
+        assert keys.nonce_b == expected.nonce_b
@@ -0,0 +1,137 @@
+# SPDX-FileCopyrightText: 2024 yanchan09 <yan@omg.lol>
+#
+# SPDX-License-Identifier: 0BSD
+
+from concurrent.futures import ThreadPoolExecutor
+from krkrz.bench import generate_table
+from krkrz.cx3.hashdb import HashDatabase, HashType
+from krkrz.cx3.table import ArchiveTable
+
+
+def _insert(hdb: HashDatabase, kind: int, hash: bytes, value: None | str) -> None:
+    encoded = None if value is None else value.encode("utf-16-le")
+    hdb.cursor.execute(
+        "INSERT INTO known_hashes (type, hash, value) VALUES (?, ?, ?)",
+        (kind, hash, encoded),
+    )
+
+
+def test_resolve_many(tmp_path):
+    hdb = HashDatabase(str(tmp_path / "hashes.db"))
+    for i in range(1200):
+        _insert(hdb, HashType.FILE_BLAKE2S, i.to_bytes(4, "big"), f"file{i}")
+    _insert(hdb, HashType.FILE_BLAKE2S, b"null", None)
+    _insert(hdb, HashType.PATH_SIPHASH_48, b"path", "path/")
+
+    hashes = [i.to_bytes(4, "big") for i in range(0, 1500, 2)] + [b"null", b"path"]
+    resolved = hdb.resolve_many(HashType.FILE_BLAKE2S, hashes)
+    assert len(resolved) == 601
+    assert resolved[(1000).to_bytes(4, "big")] == "file1000"
+    assert resolved[b"null"] == ""
+    for hash in hashes:
+        assert resolved.get(hash) == hdb.resolve_hash(HashType.FILE_BLAKE2S, hash)
+
+
+def test_dump_resolves_names(tmp_path, capsys):
+    table = ArchiveTable(generate_table(3, 2))
+    hdb = HashDatabase(str(tmp_path / "hashes.db"))
+    _insert(hdb, HashType.PATH_SIPHASH_48, table.paths[1].hash, "system/")
+    _insert(hdb, HashType.FILE_BLAKE2S, table.paths[2].files[0].hash, "main.tjs")
+
+    table.dump(hdb)
+    output = capsys.readouterr().out
+    assert f"* Path system/ ({table.paths[1].hash.hex()})" in output
+    assert f"- Name hash: main.tjs ({table.paths[2].files[0].hash.hex()})" in output
+
+
+def test_resolve_cache(tmp_path):
+    hdb = HashDatabase(str(tmp_path / "hashes.db"), cache_size=2)
+    _insert(hdb, HashType.FILE_BLAKE2S, b"a", "a.txt")
+    assert hdb.resolve_hash(HashType.FILE_BLAKE2S, b"a") == "a.txt"
+    assert hdb.resolve_hash(HashType.FILE_BLAKE2S, b"b") is None
+    assert (hdb.hits, hdb.misses) == (0, 2)
+
+    # Both results are cached, including the unknown hash
+    _insert(hdb, HashType.FILE_BLAKE2S, b"b", "b.txt")
+    assert hdb.resolve_hash(HashType.FILE_BLAKE2S, b"a") == "a.txt"
+    assert hdb.resolve_hash(HashType.FILE_BLAKE2S, b"b") is None
+    assert (hdb.hits, hdb.misses) == (2, 2)
+
+    # c evicts a, the least recently used entry
+    assert hdb.resolve_hash(HashType.FILE_BLAKE2S, b"c") is None
+    assert list(hdb.cache) == [
+        (HashType.FILE_BLAKE2S, b"b"),
+        (HashType.FILE_BLAKE2S, b"c"),
+    ]
+    assert hdb.resolve_many(HashType.FILE_BLAKE2S, [b"a", b"c"]) == {b"a": "a.txt"}
+    assert (hdb.hits, hdb.misses) == (3, 4)
+
+    hdb.clear_cache()
+    assert hdb.resolve_hash(HashType.FILE_BLAKE2S, b"b") == "b.txt"
+
+
+def test_cache_insert_race(tmp_path):
+    hdb = HashDatabase(str(tmp_path / "hashes.db"))
+    query = hdb._query
+
+    def racing_query(sql, params):
+        # The row lands after the lookup read the database
+        rows = query(sql, params)
+        hdb.insert_many([(HashType.FILE_BLAKE2S, b"a", None, "a.txt")])
+        return rows
+
+    hdb._query = racing_query
+    assert hdb.resolve_hash(HashType.FILE_BLAKE2S, b"a") is None
+    assert hdb.resolve_many(HashType.FILE_BLAKE2S, [b"b"]) == {}
+    hdb.preload(HashType.FILE_BLAKE2S)
+    # Nothing read before an insert is kept
+    assert hdb.cache == {}
+    assert hdb.preloaded == {}
+
+    hdb._query = query
+    assert hdb.resolve_hash(HashType.FILE_BLAKE2S, b"a") == "a.txt"
+
+
+def test_preload(tmp_path):
+    hdb = HashDatabase(str(tmp_path / "hashes.db"))
+    _insert(hdb, HashType.FILE_BLAKE2S, b"a", "a.txt")
+    _insert(hdb, HashType.PATH_SIPHASH_48, b"a", "a/")
+    hdb.preload(HashType.FILE_BLAKE2S)
+    hdb.conn.close()
+
+    assert hdb.resolve_hash(HashType.FILE_BLAKE2S, b"a") == "a.txt"
+    assert hdb.resolve_hash(HashType.FILE_BLAKE2S, b"b") is None
+    assert hdb.resolve_many(HashType.FILE_BLAKE2S, [b"a", b"b"]) == {b"a": "a.txt"}
+    assert hdb.hits == 4
+
+
+def test_threads(tmp_path):
+    hdb = HashDatabase(str(tmp_path / "hashes.db"), cache_size=0, write_batch=100)
+    assert hdb.conn.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+    hdb.insert_many(
+        (HashType.FILE_BLAKE2S, i.to_bytes(4, "big"), None, f"file{i}")
+        for i in range(1000)
+    )
+
+    def work(worker: int) -> tuple[int, int]:
+        # Resolves the shared rows while queueing rows of its own
+        resolved = hdb.resolve_many(
+            HashType.FILE_BLAKE2S, [i.to_bytes(4, "big") for i in range(1000)]
+        )
+        written = 0
+        for i in range(250):
+            written += hdb.queue_insert(
+                [(HashType.PATH_SIPHASH_48, bytes([worker, i]), None, f"{worker}/")]
+            )
+        return len(resolved), written
+
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(work, range(4)))
+    written = sum(w for _, w in results) + hdb.flush()
+    assert [r for r, _ in results] == [1000] * 4
+    assert written == 1000
+    assert 0 < len(hdb.readers) <= 4
+
+    assert hdb.resolve_hash(HashType.PATH_SIPHASH_48, bytes([3, 249])) == "3/"
+    hdb.close()
+    assert hdb.readers == []
@@ -0,0 +1,56 @@
+# SPDX-FileCopyrightText: 2024 yanchan09 <yan@omg.lol>
+#
+# SPDX-License-Identifier: 0BSD
+
+import hashlib
+from krkrz.cx3.hashdb import HashDatabase, HashType
+from krkrz.cx3.hashindex import SortedHashIndex, export_index, is_index
+
+
+def test_sorted_hash_index(tmp_path):
+    hdb = HashDatabase(str(tmp_path / "hashes.db"))
+    rows = [
+        (HashType.FILE_BLAKE2S, hashlib.blake2s(b"%d" % i).digest(), None, f"f{i}")
+        for i in range(1000)
+    ]
+    rows += [
+        (
+            HashType.PATH_SIPHASH_48,
+            hashlib.sha256(b"%d" % i).digest()[:8],
+            None,
+            f"p{i}/",
+        )
+        for i in range(100)
+    ]
+    hdb.insert_many(rows)
+    hdb.cursor.execute(
+        "INSERT INTO known_hashes (type, hash) VALUES (?, ?)",
+        (HashType.FILE_BLAKE2S, b"\x00" * 32),
+    )
+    # Shares its first 8 bytes with a known hash
+    collision = rows[5][1][:8] + b"\xee" * 24
+    hdb.insert_many([(HashType.FILE_BLAKE2S, collision, None, "collision")])
+    hdb.conn.commit()
+
+    path = str(tmp_path / "hashes.idx")
+    export_index(hdb, path)
+    assert is_index(path)
+    assert not is_index(str(tmp_path / "hashes.db"))
+
+    index = SortedHashIndex(path)
+    for kind, hash, _, value in rows:
+        assert index.resolve_hash(kind, hash) == value
+    assert index.resolve_hash(HashType.FILE_BLAKE2S, b"\x00" * 32) == ""
+    assert index.resolve_hash(HashType.FILE_BLAKE2S, b"\xff" * 32) is None
+    assert index.resolve_hash(HashType.FILE_BLAKE2S, rows[-1][1]) is None
+    assert index.resolve_hash(3, rows[0][1]) is None
+
+    for kind in [HashType.FILE_BLAKE2S, HashType.PATH_SIPHASH_48]:
+        hashes = [hash for _, hash, _, _ in rows[::7]]
+        hashes += [rows[5][1], collision, b"\x00" * 32, b"\xff" * 32, b"short"]
+        resolved = index.resolve_many(kind, hashes)
+        assert resolved == hdb.resolve_many(kind, hashes)
+        assert resolved
+    assert index.resolve_many(HashType.FILE_BLAKE2S, [collision]) == {
+        collision: "collision"
+    }
@@ -0,0 +1,63 @@
+# SPDX-FileCopyrightText: 2024 yanchan09 <yan@omg.lol>
+#
+# SPDX-License-Identifier: 0BSD
+
+import io
+import struct
+import zlib
+import pytest
+from Crypto.Cipher import ChaCha20_Poly1305
+from krkrz.cx3.crypt import TableKeys
+from krkrz.cx3.hxv4 import find_table_ref, parse_table_ref, read_table
+from krkrz.xp3 import MAGIC, XP3Archive
+
+KEYS = TableKeys(bytes(range(96)))
+
+
+def _encrypted_table(data: bytes, flag: int, truncate: int = 0) -> bytes:
+    nonce = KEYS.nonce_b if flag == 0 else KEYS.nonce_a
+    cipher = ChaCha20_Poly1305.new(key=KEYS.key, nonce=nonce)
+    compressed = zlib.compress(data)
+    plaintext = struct.pack("<I", len(data)) + compressed[: len(compressed) - truncate]
+    ciphertext, tag = cipher.encrypt_and_digest(plaintext)
+    return tag + ciphertext
+
+
+@pytest.mark.parametrize("flag", [0, 1])
+def test_read_table(flag):
+    data = bytes(range(256)) * 1000
+    table = _encrypted_table(data, flag)
+    file = io.BytesIO(b"\xff" * 100 + table + b"\xff" * 100)
+
+    ref = parse_table_ref(struct.pack("<QIH", 100, len(table), flag))
+    assert read_table(file, *ref, KEYS, chunk_size=3) == data
+    assert read_table(file, *ref, KEYS) == data
+
+
+def test_read_table_tampered():
+    table = bytearray(_encrypted_table(b"table" * 100, 0))
+    table[-1] ^= 1
+    with pytest.raises(ValueError):
+        read_table(io.BytesIO(table), 0, len(table), 0, KEYS)
+
+
+def test_read_table_truncated():
+    table = _encrypted_table(b"table" * 100, 0, truncate=4)
+    with pytest.raises(Exception, match="Truncated zlib stream"):
+        read_table(io.BytesIO(table), 0, len(table), 0, KEYS)
+
+
+def test_find_table_ref():
+    def archive(index: bytes) -> XP3Archive:
+        return XP3Archive.from_buffer(
+            MAGIC + struct.pack("<qBq", 19, 0, len(index)) + index
+        )
+
+    ref = struct.pack("<QIH", 100, 200, 1)
+    assert find_table_ref(archive(struct.pack("<4sq", b"Hxv4", 14) + ref)) == (
+        100,
+        200,
+        1,
+    )
+    with pytest.raises(Exception, match="doesn't include Hxv4"):
+        find_table_ref(archive(b""))
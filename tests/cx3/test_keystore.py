@@ -0,0 +1,68 @@
+# SPDX-FileCopyrightText: 2024 yanchan09 <yan@omg.lol>
+#
+# SPDX-License-Identifier: 0BSD
+
+import sqlite3
+import pytest
+from krkrz.cx3.crypt import KeyDerivator
+from krkrz.cx3.keystore import KeyStore
+
+
+def _derivator(archive_unique_key: str = "ArchiveUniqueKey0123456789") -> KeyDerivator:
+    return KeyDerivator(
+        bootstrap_string="BOOTSTRAPbootstrap0123456789",
+        warning_string="WARNINGwarning0123456789",
+        params_blob=b"\x00\x01\x02\x03\x04\x05\x06\x07\x08\x09",
+        archive_unique_key=archive_unique_key,
+        upper_key_seed=b"\x00\x11\x22\x33\x44\x55\x66\x77",
+    )
+
+
+def test_cached_derive(tmp_path, monkeypatch):
+    store = KeyStore(str(tmp_path / "keys.db"))
+    derivator = _derivator()
+    keys = derivator.derive(cached=True, store=store)
+    assert len(store) == 1
+
+    def fail() -> bytes:
+        raise Exception("Keys should come from the store")
+
+    monkeypatch.setattr(derivator, "_derive_buffer", fail)
+    cached_keys = derivator.derive(cached=True, store=store)
+    assert cached_keys.key == keys.key
+    assert cached_keys.nonce_a == keys.nonce_a
+    assert cached_keys.nonce_b == keys.nonce_b
+    assert _derivator("Other").digest() != derivator.digest()
+
+
+def test_keystore_eviction(tmp_path, monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr("time.time", lambda: now)
+
+    store = KeyStore(str(tmp_path / "keys.db"), max_age=100, max_entries=2)
+    store.put(b"a", b"A")
+    now += 10
+    store.put(b"b", b"B")
+    now += 10
+    assert store.get(b"a") == b"A"
+    store.put(b"c", b"C")
+    # b was used least recently
+    assert store.get(b"b") is None
+    assert len(store) == 2
+
+    now += 95
+    assert store.get(b"a") is None
+    assert store.get(b"c") == b"C"
+    store.evict()
+    assert len(store) == 1
+
+
+def test_default_store(tmp_path, monkeypatch):
+    path = str(tmp_path / "keys.db")
+    monkeypatch.setenv("KRKRZ_KEYSTORE", path)
+    _derivator().derive(cached=True)
+
+    with KeyStore(path) as store:
+        assert len(store) == 1
+    with pytest.raises(sqlite3.ProgrammingError):
+        len(store)
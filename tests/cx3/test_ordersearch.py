@@ -0,0 +1,66 @@
+# SPDX-FileCopyrightText: 2024 yanchan09 <yan@omg.lol>
+#
+# SPDX-License-Identifier: 0BSD
+
+from krkrz._rng import SplitMix64
+from krkrz.cx3.bytecode import Blackbox, RNGVariant
+from krkrz.cx3.ordersearch import OrderSearch, complete_orders
+
+ORDER = [3, 1, 4, 0, 7, 5, 2, 6, 2, 0, 5, 1, 4, 3, 1, 2, 0]
+
+
+def _search(known: int) -> OrderSearch:
+    rng = SplitMix64(0x1234)
+    seed_block = [rng.next() & 0xFFFFFFFF for _ in range(1024)]
+    blackbox = Blackbox(ORDER, RNGVariant.PLUS, seed_block=seed_block)
+    pairs = [
+        (value, blackbox.execute(value)) for value in (rng.next() for _ in range(16))
+    ]
+    return OrderSearch(
+        pairs,
+        RNGVariant.PLUS,
+        seed_block,
+        known=ORDER[:known] + [None] * (len(ORDER) - known),
+    )
+
+
+def test_complete_orders():
+    domains = (
+        tuple(frozenset([ORDER.index(val)]) for val in range(8)),
+        tuple(frozenset([8 + ORDER[8:14].index(val)]) for val in range(6)),
+        (frozenset([14, 15, 16]),) * 3,
+    )
+    orders = list(complete_orders(domains))
+    assert len(orders) == 6
+    assert ORDER in orders
+
+
+def test_search_recovers_order():
+    assert _search(4).run() == [ORDER]
+
+
+def test_search_parallel(tmp_path):
+    search = _search(4)
+    checkpoint = str(tmp_path / "checkpoint.json")
+    reports = []
+
+    def progress(done: int, total: int, found: int) -> None:
+        reports.append((done, total))
+
+    orders = search.run_parallel(workers=2, checkpoint=checkpoint, progress=progress)
+    assert orders == [ORDER]
+    assert reports[-1][0] == reports[-1][1]
+
+    # Everything is in the checkpoint already, so nothing gets searched again
+    reports.clear()
+    orders = search.run_parallel(workers=2, checkpoint=checkpoint, progress=progress)
+    assert orders == [ORDER]
+    assert reports == []
+
+    # A search with other inputs doesn't resume from the checkpoint
+    reports.clear()
+    orders = _search(5).run_parallel(
+        workers=2, checkpoint=checkpoint, progress=progress
+    )
+    assert orders == [ORDER]
+    assert reports
@@ -0,0 +1,111 @@
+# SPDX-FileCopyrightText: 2024 yanchan09 <yan@omg.lol>
+#
+# SPDX-License-Identifier: 0BSD
+
+import struct
+import pytest
+from krkrz.bench import generate_table
+from krkrz.cx3.table import ArchiveTable, MarshalError, MarshalReader
+
+
+def test_read_value():
+    data = (
+        struct.pack(">BI", 0x81, 3)
+        + struct.pack(">BI", 0x03, 2)
+        + b"ab"
+        + struct.pack(">BI", 0x81, 0)
+        + struct.pack(">BI", 0x81, 1)
+        + struct.pack(">BQ", 0x04, 0x0123456789ABCDEF)
+        + struct.pack(">BQ", 0x04, 7)
+    )
+    reader = MarshalReader(data)
+    assert reader.read_value() == [b"ab", [], [0x0123456789ABCDEF]]
+    assert reader.read_value() == 7
+    assert reader.offset == len(data)
+
+
+def test_read_value_zero_copy():
+    data = struct.pack(">BI", 0x81, 1) + struct.pack(">BI", 0x03, 3) + b"abc"
+    [value] = MarshalReader(data, zero_copy=True).read_value()
+    assert isinstance(value, memoryview)
+    assert value == b"abc"
+
+
+def test_read_value_deeply_nested():
+    depth = 100000
+    data = struct.pack(">BI", 0x81, 1) * depth + struct.pack(">BQ", 0x04, 1)
+    value = MarshalReader(data).read_value()
+    for _ in range(depth):
+        [value] = value
+    assert value == 1
+
+
+def test_archive_table_index():
+    data = generate_table(5, 3)
+    table = ArchiveTable(data)
+    path = table.paths[2]
+    file = path.files[1]
+    assert table.lookup(path.hash, file.hash) == file
+    assert table.lookup(table.paths[0].hash, file.hash) is None
+    assert table.by_id(file.id) == file
+    assert table.by_id(1000) is None
+    assert table.files_in(path.hash) == path.files
+    assert table.files_in(b"\x00" * 8) == []
+    for path in table.paths:
+        assert table.files_in(path.hash) == path.files
+        for file in path.files:
+            assert table.lookup(path.hash, file.hash) == file
+            assert table.by_id(file.id) == file
+
+    # Tables made from columns view their paths without listing them
+    columns_table = ArchiveTable.from_columns(table.columns)
+    assert len(columns_table.paths) == 5
+    assert columns_table.paths[-1] == table.paths[4]
+    assert columns_table.paths[1:3] == table.paths[1:3]
+    assert list(columns_table.paths) == table.paths
+    with pytest.raises(IndexError):
+        columns_table.paths[5]
+
+
+def test_iter_paths():
+    data = generate_table(5, 3)
+    paths = ArchiveTable.iter_paths(data)
+    first = next(paths)
+    assert [file.id for file in first.files] == [0, 1, 2]
+    assert len(list(paths)) == 4
+
+    with pytest.raises(MarshalError, match="Expected an array"):
+        next(ArchiveTable.iter_paths(struct.pack(">BQ", 0x04, 1)))
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"",
+        b"\x81\x00\x00\x00\x02",
+        b"\x03\x00\x00\x00\x08ab",
+        b"\x04\x00\x00",
+    ],
+)
+def test_read_truncated(data):
+    with pytest.raises(MarshalError, match="Truncated"):
+        MarshalReader(data).read_value()
+
+
+def test_read_unknown_type():
+    with pytest.raises(MarshalError, match="Unknown value type: 05"):
+        MarshalReader(b"\x05").read_value()
+
+
+def test_table_columns():
+    table = ArchiveTable(generate_table(4, 3))
+    columns = table.columns
+    assert len(columns) == 12
+    assert list(columns.path_offsets) == [0, 3, 6, 9, 12]
+    assert list(columns.ids) == list(range(12))
+    file = table.paths[1].files[2]
+    assert columns.keys[5] == file.key
+    assert columns.name_hashes[5 * 32 : 6 * 32] == file.hash
+
+    np = pytest.importorskip("numpy")
+    assert np.frombuffer(columns.keys, dtype=np.uint64)[5] == file.key
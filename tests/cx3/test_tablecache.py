@@ -0,0 +1,85 @@
+# SPDX-FileCopyrightText: 2024 yanchan09 <yan@omg.lol>
+#
+# SPDX-License-Identifier: 0BSD
+
+import os
+from krkrz.bench import generate_table
+from krkrz.cx3.table import ArchiveTable
+from krkrz.cx3.tablecache import TableCache
+
+
+def test_table_cache(tmp_path):
+    archive_path = str(tmp_path / "data.xp3")
+    with open(archive_path, "wb") as f:
+        f.write(b"archive")
+    cache = TableCache(str(tmp_path / "cache"))
+    assert cache.load(archive_path, 1234) is None
+
+    table = ArchiveTable(generate_table(20, 5))
+    cache.save(archive_path, 1234, table)
+    cached = cache.load(archive_path, 1234)
+    assert cached is not None
+    assert len(cached.paths) == 20
+    for path, cached_path in zip(table.paths, cached.paths):
+        assert cached_path.hash == path.hash
+        for file, cached_file in zip(path.files, cached_path.files):
+            assert (cached_file.hash, cached_file.id, cached_file.key) == (
+                file.hash,
+                file.id,
+                file.key,
+            )
+    # The index is searched in place in the mapping
+    assert isinstance(cached.index.path_order, memoryview)
+    for path in table.paths:
+        assert [f.index for f in cached.files_in(path.hash)] == [
+            f.index for f in path.files
+        ]
+        for file in path.files:
+            assert cached.lookup(path.hash, file.hash) == cached.by_id(file.id)
+            assert cached.by_id(file.id).index == file.index
+    assert cached.lookup(b"\x00" * 8, b"\x00" * 8) is None
+
+    # Other Hxv4 offsets and modified archives miss
+    assert cache.load(archive_path, 1235) is None
+    os.utime(archive_path, ns=(0, 0))
+    assert cache.load(archive_path, 1234) is None
+
+
+def test_table_cache_truncated(tmp_path):
+    archive_path = str(tmp_path / "data.xp3")
+    with open(archive_path, "wb") as f:
+        f.write(b"archive")
+    cache = TableCache(str(tmp_path / "cache"))
+    cache.save(archive_path, 0, ArchiveTable(generate_table(20, 5)))
+
+    [cache_file] = os.listdir(tmp_path / "cache")
+    os.truncate(tmp_path / "cache" / cache_file, 200)
+    assert cache.load(archive_path, 0) is None
+
+
+def test_table_cache_eviction(tmp_path, monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr("time.time", lambda: now)
+    cache_dir = tmp_path / "cache"
+    cache = TableCache(str(cache_dir), max_age=100)
+    table = ArchiveTable(generate_table(20, 5))
+    archive_paths = []
+    for i, mtime in enumerate([now - 10, now - 150, now - 20]):
+        archive_path = str(tmp_path / f"data{i}.xp3")
+        with open(archive_path, "wb") as f:
+            f.write(b"archive")
+        archive_paths.append(archive_path)
+        cache.save(archive_path, 0, table)
+        os.utime(cache._path(archive_path, 0), (mtime, mtime))
+    size = os.path.getsize(cache._path(archive_paths[0], 0))
+
+    # data1.xp3's table is older than max_age
+    cache.evict()
+    assert len(os.listdir(cache_dir)) == 2
+    assert cache.load(archive_paths[1], 0) is None
+
+    # Loading marks data2.xp3's table as used last, so it's the one kept
+    assert cache.load(archive_paths[2], 0) is not None
+    cache.max_bytes = size
+    cache.evict()
+    assert os.listdir(cache_dir) == [os.path.basename(cache._path(archive_paths[2], 0))]
@@ -0,0 +1,22 @@
+# SPDX-FileCopyrightText: 2024 yanchan09 <yan@omg.lol>
+#
+# SPDX-License-Identifier: 0BSD
+
+from krkrz.bench import compare, generate_table, run_benchmarks
+from krkrz.cx3.table import ArchiveTable
+
+
+def test_generate_table():
+    table = ArchiveTable(generate_table(10, 3))
+    assert len(table.paths) == 10
+    assert [file.id for file in table.paths[1].files] == [3, 4, 5]
+
+
+def test_run_benchmarks():
+    report = run_benchmarks(["rng.splitmix64"], repeat=1, min_time=0.001)
+    assert list(report["results"]) == ["rng.splitmix64.next"]
+    assert report["results"]["rng.splitmix64.next"]["best"] > 0
+
+    slower = {"results": {"rng.splitmix64.next": {"best": 1e9}}}
+    assert compare(slower, report, 0.1) == []
+    assert compare(report, slower, 0.1) == ["rng.splitmix64.next"]
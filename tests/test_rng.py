@@ -2,8 +2,17 @@
 #
 # SPDX-License-Identifier: 0BSD
 
+import pytest
+import krkrz._rng
 from krkrz._rng import SplitMix64, Xoroshiro128PlusPlus, Xoroshiro128StarStar
 
+GENERATORS = [
+    lambda: SplitMix64(0x4242424242424242),
+    lambda: SplitMix64(0xFFFFFFFFFFFFFFF0),
+    lambda: Xoroshiro128PlusPlus((0x0123456789ABCDEF, 0xFEDCBA9876543210)),
+    lambda: Xoroshiro128StarStar((0x0123456789ABCDEF, 0xFEDCBA9876543210)),
+]
+
 
 def test_splitmix64():
     i = SplitMix64()
@@ -29,3 +38,60 @@ def test_xoroshiro128starstar():
     assert i.next() == 0x9999999999998192
     assert i.next() == 0x99999981A9E65912
     assert i.next() == 0x8D91F41DE505EB24
+
+
+@pytest.mark.parametrize("numpy", [True, False])
+@pytest.mark.parametrize("make_rng", GENERATORS)
+def test_bulk_output(monkeypatch, make_rng, numpy):
+    if numpy:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(krkrz._rng, "np", None)
+
+    bulk = make_rng()
+    single = make_rng()
+    values = [int(v) for v in bulk.fill(100)]
+    assert values == [single.next() for _ in range(100)]
+    values = [int(v) for v in bulk.next_u32_array(100)]
+    assert values == [single.next() & 0xFFFFFFFF for _ in range(100)]
+    assert bulk.next() == single.next()
+
+
+def test_splitmix64_advance():
+    advanced = SplitMix64(0x4242424242424242)
+    stepped = SplitMix64(0x4242424242424242)
+    advanced.advance(1000)
+    for _ in range(1000):
+        stepped.next()
+    assert advanced.next() == stepped.next()
+
+
+@pytest.mark.parametrize("cls", [Xoroshiro128PlusPlus, Xoroshiro128StarStar])
+def test_xoroshiro128_advance(cls):
+    state = (0x0123456789ABCDEF, 0xFEDCBA9876543210)
+    for n in [0, 1, 127, 128, 1000]:
+        advanced = cls(state)
+        stepped = cls(state)
+        advanced.advance(n)
+        for _ in range(n):
+            stepped.next()
+        assert advanced.next() == stepped.next()
+
+    advanced = cls(state)
+    advanced.advance(1000)
+    advanced.advance(-1000)
+    assert advanced.state == state
+
+
+@pytest.mark.parametrize("cls", [Xoroshiro128PlusPlus, Xoroshiro128StarStar])
+def test_xoroshiro128_jump(cls):
+    state = (0x0123456789ABCDEF, 0xFEDCBA9876543210)
+    jumped = cls(state)
+    advanced = cls(state)
+    jumped.jump()
+    advanced.advance(2**64)
+    assert jumped.state == advanced.state
+
+    jumped.long_jump()
+    advanced.advance(2**96)
+    assert jumped.state == advanced.state
@@ -0,0 +1,207 @@
+# SPDX-FileCopyrightText: 2024 yanchan09 <yan@omg.lol>
+#
+# SPDX-License-Identifier: 0BSD
+
+import os
+import struct
+import zlib
+import pytest
+from krkrz.xp3 import MAGIC, FileFlag, IndexFlag, SegmentFlag, XP3Archive
+
+
+def _chunk(ty: bytes, data: bytes) -> bytes:
+    return struct.pack("<4sq", ty, len(data)) + data
+
+
+def _file_chunk(
+    name: str,
+    flags: int,
+    segments: list[tuple[int, int, int, int]],
+    adler32: None | int,
+) -> bytes:
+    encoded = name.encode("utf-16-le")
+    size = sum(segment[2] for segment in segments)
+    packed_size = sum(segment[3] for segment in segments)
+    info = struct.pack("<IQQH", flags, size, packed_size, len(name)) + encoded
+    segm = b"".join(struct.pack("<IQQQ", *segment) for segment in segments)
+    data = _chunk(b"info", info) + _chunk(b"segm", segm)
+    if adler32 is not None:
+        data += _chunk(b"adlr", struct.pack("<I", adler32))
+    return _chunk(b"File", data)
+
+
+def _archive(body: bytes, blocks: list[tuple[IndexFlag, bytes]]) -> bytes:
+    # Archive data followed by a chain of index blocks
+    data = MAGIC + struct.pack("<q", 19 + len(body)) + body
+    for i, (flags, index_data) in enumerate(blocks):
+        if i + 1 < len(blocks):
+            flags |= IndexFlag.CONTINUE
+        if IndexFlag.COMPRESSED_ZLIB in flags:
+            compressed = zlib.compress(index_data)
+            data += bytes([flags]) + struct.pack(
+                "<qq", len(compressed), len(index_data)
+            )
+            data += compressed
+        else:
+            data += bytes([flags]) + struct.pack("<q", len(index_data)) + index_data
+        if i + 1 < len(blocks):
+            data += struct.pack("<q", len(data) + 8)
+    return data
+
+
+def test_open(tmp_path):
+    path = tmp_path / "data.xp3"
+    path.write_bytes(
+        _archive(
+            b"\x00" * 1000,
+            [
+                (IndexFlag(0), _chunk(b"File", b"file") + _chunk(b"Hxv4", b"ref1")),
+                (IndexFlag.COMPRESSED_ZLIB, _chunk(b"Hxv4", b"ref2")),
+            ],
+        )
+    )
+    expected = [(b"File", b"file"), (b"Hxv4", b"ref1"), (b"Hxv4", b"ref2")]
+
+    with open(path, "rb") as f:
+        assert XP3Archive(f).index_chunks == expected
+    assert XP3Archive.open(str(path), use_mmap=False).index_chunks == expected
+
+    with XP3Archive.open(str(path)) as archive:
+        assert archive.mapping is not None
+        assert len(archive.index_blocks) == 2
+        # Nothing is decompressed until the chunks of a block are reached
+        assert next(archive.iter_chunks()) == (b"File", b"file")
+        assert list(archive.index_data) == [0]
+        assert archive.index_chunks == expected
+        assert list(archive.index_data) == [0, 1]
+        assert archive.get_chunk(b"Hxv4") == b"ref2"
+    assert archive.mapping is None
+
+    # Chunks are released on close, but views derived from them keep the
+    # mapping open
+    archive = XP3Archive.open(str(path))
+    chunk = archive.get_chunk(b"File")
+    derived = chunk[1:]
+    with pytest.raises(BufferError):
+        archive.close()
+    with pytest.raises(ValueError):
+        bytes(chunk)
+    derived.release()
+    archive.close()
+    assert archive.mapping is None
+
+
+def test_entries(tmp_path):
+    path = tmp_path / "data.xp3"
+    path.write_bytes(
+        _archive(
+            b"",
+            [
+                (
+                    IndexFlag.COMPRESSED_ZLIB,
+                    _file_chunk("startup.tjs", 0, [(0, 19, 100, 100)], 0x1234)
+                    + _chunk(b"Hxv4", b"ref")
+                    + _file_chunk(
+                        "data/bgm.ogg",
+                        FileFlag.PROTECTED,
+                        [(1, 119, 400, 300), (0, 419, 50, 50)],
+                        0x5678,
+                    ),
+                )
+            ],
+        )
+    )
+
+    with XP3Archive.open(str(path)) as archive:
+        assert archive.get_chunk(b"Hxv4") == b"ref"
+        assert archive.get_chunk(b"time") is None
+        assert len(archive.entries) == 2
+        assert archive.entry("missing") is None
+
+        entry = archive.entry("data/bgm.ogg")
+        assert entry is not None
+        assert entry == list(archive.iter_entries())[1]
+        assert entry.flags == FileFlag.PROTECTED
+        assert (entry.size, entry.packed_size, entry.adler32) == (450, 350, 0x5678)
+        assert entry.segments == [
+            (SegmentFlag.COMPRESSED_ZLIB, 119, 400, 300),
+            (SegmentFlag(0), 419, 50, 50),
+        ]
+        assert archive.entry("startup.tjs").segments == [(0, 19, 100, 100)]
+
+
+def test_entry_adler32(tmp_path):
+    path = tmp_path / "data.xp3"
+    path.write_bytes(
+        _archive(
+            b"",
+            [
+                (
+                    IndexFlag(0),
+                    _file_chunk("zero.txt", 0, [(0, 19, 0, 0)], 0)
+                    + _file_chunk("none.txt", 0, [(0, 19, 0, 0)], None),
+                )
+            ],
+        )
+    )
+
+    with XP3Archive.open(str(path)) as archive:
+        assert archive.entry("zero.txt").adler32 == 0
+        assert archive.entry("none.txt").adler32 is None
+        # The empty file sums to 1, so a stored 0 is a mismatch
+        with pytest.raises(Exception, match="Adler-32 mismatch in .*zero.txt"):
+            archive.extract_all(str(tmp_path / "out"), workers=1)
+
+
+@pytest.mark.parametrize("pread", [True, False])
+def test_extract_all(tmp_path, monkeypatch, pread):
+    if not pread:
+        # Extraction seeks a shared file where pread is missing
+        monkeypatch.delattr(os, "pread", raising=False)
+    contents = {
+        f"dir{i % 3}/file{i}.txt": bytes([i]) * (i * 997 % 5000) for i in range(40)
+    }
+    body = b""
+    chunks = b""
+    for i, (name, content) in enumerate(contents.items()):
+        # Odd files are compressed, and every file has two segments
+        offset = 19 + len(body)
+        half = len(content) // 2
+        segments = []
+        for part in (content[:half], content[half:]):
+            stored = zlib.compress(part) if i % 2 else part
+            segments.append((i % 2, 19 + len(body), len(part), len(stored)))
+            body += stored
+        assert segments[0][1] == offset
+        chunks += _file_chunk(name, 0, segments, zlib.adler32(content))
+    path = tmp_path / "data.xp3"
+    path.write_bytes(_archive(body, [(IndexFlag.COMPRESSED_ZLIB, chunks)]))
+
+    seen = []
+    with XP3Archive.open(str(path)) as archive:
+        stats = archive.extract_all(
+            str(tmp_path / "out"), workers=4, progress=lambda s: seen.append(s.files)
+        )
+    assert seen == list(range(1, 41))
+    assert stats.bytes_written == sum(len(c) for c in contents.values())
+    assert stats.bytes_read == len(body)
+    for name, content in contents.items():
+        assert (tmp_path / "out" / name).read_bytes() == content
+
+
+def test_extract_rejects_bad_entries(tmp_path):
+    for name, adler32, match in [
+        ("../escape.txt", 1, "Invalid entry name"),
+        ("ok.txt", 2, "Adler-32 mismatch"),
+        ("Dir/A.txt", 1, "Duplicate entry name 'dir/a.txt'"),
+    ]:
+        path = tmp_path / "data.xp3"
+        chunks = _file_chunk(name, 0, [(0, 19, 0, 0)], adler32)
+        if name.startswith("Dir/"):
+            chunks += _file_chunk("dir/a.txt", 0, [(0, 19, 0, 0)], 1)
+        path.write_bytes(_archive(b"", [(IndexFlag(0), chunks)]))
+        with XP3Archive.open(str(path)) as archive:
+            with pytest.raises(Exception, match=match):
+                archive.extract_all(str(tmp_path / "out"))
+    assert not (tmp_path / "escape.txt").exists()
+    assert not (tmp_path / "out" / "Dir").exists()